@@ -7,6 +7,8 @@
 """
 
 
+import atexit
+import json
 import logging
 import optparse
 import os
@@ -20,6 +22,11 @@ import yaml
 
 import proboscis
 
+import quall.cache
+import quall.distributed
+import quall.metrics
+import quall.resources
+
 try:
   from yaml import CLoader as Loader
 except ImportError:
@@ -32,6 +39,7 @@ logging.basicConfig(level=logging.DEBUG, format=LOG_FORMAT)
 class QuallBase(object):
 
   CONFIG_FILE = "%s/config/base_config.yml" % os.getcwd()
+  DEFAULT_ARTIFACT_CACHE_PATH = os.path.join("~", ".cache", "quall", "artifacts")
 
   def __init__(self):
 
@@ -39,9 +47,48 @@ class QuallBase(object):
     self.log = logging.getLogger("quall.base")
     pass
 
+  @property
+  def resources(self):
+    return quall.resources.get_resource_manager()
+
   def cfg(self, section, var):
     return self.config[section][var]
 
+  def enter_resource_scope(self, scope):
+    """
+    Begins a resource scope; call from a proboscis C{@before_class} (or group
+    setup) hook so shared resources are created once per scope.
+
+    @param scope: one of the scopes defined in L{quall.resources}
+    @type scope: str
+    """
+
+    self.resources.enter_scope(scope)
+
+  def exit_resource_scope(self, scope):
+    """
+    Ends a resource scope, tearing down every resource created within it in
+    reverse order; call from the matching proboscis C{@after_class} hook.
+
+    @param scope: one of the scopes defined in L{quall.resources}
+    @type scope: str
+    """
+
+    self.resources.exit_scope(scope)
+
+  def get_artifact_cache(self):
+    """
+    Obtains the persistent artifact cache described by the C{artifact_cache}
+    configuration section.
+
+    @rtype: L{quall.cache.ArtifactCache}
+    """
+
+    cache_config = self.config.get("artifact_cache") or {}
+    return quall.cache.ArtifactCache(
+        cache_config.get("path") or self.DEFAULT_ARTIFACT_CACHE_PATH,
+        max_size = cache_config.get("max_size"))
+
   def get_free_port(self):
     sock = None
     try:
@@ -70,16 +117,76 @@ class QuallBase(object):
 
   def run_command(self, command, background = False, shell = True):
     self.log.info("Running local command: %s" % command)
+    start = time.time()
     process = subprocess.Popen(command, stdin=subprocess.PIPE,
         stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell = shell)
     if background:
       return process
     (stdout, stderr) = process.communicate()
+    quall.metrics.registry.observe("quall_local_command_seconds",
+        time.time() - start)
     self.log.info("Return code: %s" % process.returncode)
     self.log.info("Stdout: %s" % stdout)
     self.log.info("Stderr: %s" % stderr)
     return (process.returncode, stdout, stderr)
 
+  def configure_metrics(self):
+    """
+    Enables the metrics registry if the C{metrics} configuration section asks
+    for it, and arranges for it to be exported when the run ends.
+    """
+
+    metrics_config = self.config.get("metrics") or {}
+    if not metrics_config.get("enabled", False):
+      return
+    quall.metrics.registry.enabled = True
+    atexit.register(self.export_metrics)
+
+  def export_metrics(self):
+    """
+    Writes the metrics registry to the Prometheus text file and JSON summary
+    paths named in the C{metrics} configuration section.
+    """
+
+    metrics_config = self.config.get("metrics") or {}
+    if metrics_config.get("prometheus_path"):
+      self.log.info(
+          "Writing Prometheus metrics to %s" % metrics_config["prometheus_path"])
+      quall.metrics.registry.write_prometheus(metrics_config["prometheus_path"])
+    if metrics_config.get("json_path"):
+      self.log.info("Writing metrics summary to %s" % metrics_config["json_path"])
+      quall.metrics.registry.write_json(metrics_config["json_path"])
+
+  def run_distributed(self, groups):
+    """
+    Runs the requested proboscis groups across the worker nodes listed in the
+    C{distributed} configuration section, one shard per group unless
+    C{distributed.shards} lists comma-separated group sets explicitly.
+
+    @param groups: the proboscis groups to run
+    @type groups: list of str
+
+    @return: the merged report
+    @rtype: dict
+    """
+
+    shards = [[group] for group in groups]
+    distributed_config = self.config.get("distributed") or {}
+    if distributed_config.get("shards"):
+      shards = [shard.strip().split(",")
+          for shard in distributed_config["shards"]]
+    report = quall.distributed.DistributedRunner(self, shards).run()
+    report_path = (self.options.report_file or
+        distributed_config.get("report_path"))
+    if report_path:
+      self.log.info("Writing distributed report to %s" % report_path)
+      report_file = open(report_path, "w")
+      try:
+        json.dump(report, report_file, indent = 2)
+      finally:
+        report_file.close()
+    return report
+
   def sleep(self, seconds):
     self.log.info("Sleeping for %s seconds..." % seconds)
     time.sleep(seconds)
@@ -96,10 +203,30 @@ class QuallBase(object):
     parser.add_option("-g", "--group", dest = "groups",
         help = "a comma-separated list of Proboscis test groups to run",
         metavar = "PROBOSCIS_GROUPS", default = "all")
+    parser.add_option("-d", "--distributed", dest = "distributed",
+        help = "run test groups across the configured worker nodes",
+        action = "store_true", default = False)
+    parser.add_option("-r", "--report", dest = "report_file",
+        help = "path to write the distributed run's JSON report to",
+        metavar = "REPORT_FILE", default = None)
+    parser.add_option("--worker", dest = "worker", help = optparse.SUPPRESS_HELP,
+        action = "store_true", default = False)
     (self.options, args) = parser.parse_args()
     print self.options
     # Loads environment-wise harness configuration from configuration file.
     self.load_config()
+    self.configure_metrics()
+    # Shared resources live until the end of the session.
+    self.enter_resource_scope(quall.resources.SESSION)
+    groups = self.options.groups.strip().split(",")
+    # Runs a shard on behalf of a distributed coordinator.
+    if self.options.worker:
+      quall.distributed.run_worker(groups)
+      sys.exit(0)
+    # Dispatches test groups to worker nodes and merges their results.
+    if self.options.distributed:
+      report = self.run_distributed(groups)
+      sys.exit(0 if report["success"] else 1)
     # Runs all configured tests.
     #proboscis.TestProgram(
     #  groups = self.options.groups.strip().split(","),
@@ -0,0 +1,364 @@
+# -*- coding: utf-8 -*-
+"""
+    quall.cache
+    ~~~~~~~~~~~
+
+    Provides a persistent, content-addressed cache for downloaded artifacts
+    such as the Selenium server jar.
+
+    Artifacts are stored under the SHA-256 digest of their contents and indexed
+    by the URL they were requested from.  Downloads stream into a partial file
+    which is resumed on the next attempt if interrupted, and are moved into
+    place with an atomic rename while holding a per-URL file lock, so parallel
+    workers sharing a cache directory download each artifact only once.
+    Resumed downloads are conditional on the server's validator for the
+    partial file, so a changed upstream file is downloaded afresh rather than
+    spliced onto the old one.
+
+    Eviction holds a cache-wide lock and never removes an artifact used within
+    the last L{ArtifactCache.EVICTION_GRACE_PERIOD} seconds, so an artifact
+    returned to one worker is not deleted by another before it is opened.
+
+    Example::
+      cache = ArtifactCache("~/.cache/quall/artifacts", max_size = 512 << 20)
+      jar = cache.fetch("http://example.com/selenium.jar",
+          checksum = "sha256:...", mirrors = ["/mnt/mirror/selenium.jar"])
+"""
+
+
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import time
+import traceback
+import urllib2
+import urlparse
+
+import quall.exceptions
+
+try:
+  import fcntl
+except ImportError:
+  fcntl = None
+
+
+class ArtifactCacheException(quall.exceptions.QuallException):
+  """
+  Base class for all artifact cache exceptions.
+  """
+
+  pass
+
+
+class ArtifactChecksumException(ArtifactCacheException):
+  """
+  Signifies that a retrieved artifact did not match its expected checksum.
+  """
+
+  pass
+
+
+class FileLock(object):
+  """
+  Exclusive advisory lock on a file, shared between processes.  Degrades to a
+  no-op on platforms without C{fcntl}.
+  """
+
+  def __init__(self, path):
+    self.path = path
+    self._file = None
+
+  def __enter__(self):
+    self._file = open(self.path, "a")
+    if fcntl is not None:
+      fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+    return self
+
+  def __exit__(self, exc_type, exc_value, tb):
+    if fcntl is not None:
+      fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+    self._file.close()
+    self._file = None
+
+
+class ArtifactCache(object):
+  """A directory of artifacts addressed by content and indexed by URL.
+  """
+
+  BUFFER_SIZE = 1024 * 1024
+  CONTENT_ALGORITHM = "sha256"
+  # Seconds after its last use during which an artifact is never evicted.
+  EVICTION_GRACE_PERIOD = 3600
+
+  log = logging.getLogger("quall.cache")
+
+  def __init__(self, path, max_size = None):
+    """
+    @param path: the cache directory; created if it does not exist
+    @type path: str
+    @param max_size: the total size in bytes above which the least recently
+        used artifacts are evicted, or None to never evict
+    @type max_size: int
+    """
+
+    self.path = os.path.abspath(os.path.expanduser(path))
+    self.max_size = max_size
+    self.objects_dir = os.path.join(self.path, "objects")
+    self.index_dir = os.path.join(self.path, "urls")
+    self.partial_dir = os.path.join(self.path, "partial")
+    self.lock_path = os.path.join(self.path, "cache.lock")
+    for directory in (self.objects_dir, self.index_dir, self.partial_dir):
+      if not os.path.isdir(directory):
+        try:
+          os.makedirs(directory)
+        except OSError:
+          # Another worker may have created it concurrently.
+          if not os.path.isdir(directory):
+            raise
+
+  def _url_key(self, url):
+    return hashlib.sha256(url).hexdigest()
+
+  def _parse_checksum(self, checksum):
+    # Accepts "algorithm:hexdigest", defaulting to SHA-256.
+    if checksum is None:
+      return (None, None)
+    if ":" in checksum:
+      (algorithm, digest) = checksum.split(":", 1)
+    else:
+      (algorithm, digest) = (self.CONTENT_ALGORITHM, checksum)
+    return (algorithm.lower(), digest.strip().lower())
+
+  def _hash_file(self, path, algorithms):
+    hashes = dict((algorithm, hashlib.new(algorithm))
+        for algorithm in algorithms)
+    artifact = open(path, "rb")
+    try:
+      chunk = artifact.read(self.BUFFER_SIZE)
+      while chunk:
+        for file_hash in hashes.values():
+          file_hash.update(chunk)
+        chunk = artifact.read(self.BUFFER_SIZE)
+    finally:
+      artifact.close()
+    return dict((algorithm, file_hash.hexdigest())
+        for (algorithm, file_hash) in hashes.items())
+
+  def _object_path(self, digest):
+    return os.path.join(self.objects_dir, digest)
+
+  def _lookup(self, url, algorithm, digest):
+    # Content-addressed hit: the expected SHA-256 is already in the cache.
+    if algorithm == self.CONTENT_ALGORITHM:
+      if os.path.exists(self._object_path(digest)):
+        return self._object_path(digest)
+    # URL-indexed hit.
+    index_path = os.path.join(self.index_dir, self._url_key(url))
+    if not os.path.exists(index_path):
+      return None
+    index_file = open(index_path, "r")
+    try:
+      content_digest = index_file.read().strip()
+    finally:
+      index_file.close()
+    # The URL may now point at a different artifact than the pinned one.
+    if algorithm == self.CONTENT_ALGORITHM and content_digest != digest:
+      return None
+    object_path = self._object_path(content_digest)
+    if not os.path.exists(object_path):
+      return None
+    if algorithm is not None and algorithm != self.CONTENT_ALGORITHM:
+      if self._hash_file(object_path, [algorithm])[algorithm] != digest:
+        return None
+    return object_path
+
+  def _touch(self, object_path):
+    # Marks an artifact as used, unless it has just been evicted.
+    with FileLock(self.lock_path):
+      if not os.path.exists(object_path):
+        return False
+      os.utime(object_path, None)
+      return True
+
+  def _read_validator(self, partial_path):
+    validator_path = "%s.validator" % partial_path
+    if not os.path.exists(validator_path):
+      return None
+    validator_file = open(validator_path, "r")
+    try:
+      return validator_file.read().strip() or None
+    finally:
+      validator_file.close()
+
+  def _write_validator(self, partial_path, response):
+    # Records the strong ETag, or failing that the Last-Modified date, that a
+    # resumed download must match; weak ETags cannot be used with If-Range.
+    validator = response.info().getheader("ETag")
+    if validator is None or validator.startswith("W/"):
+      validator = response.info().getheader("Last-Modified")
+    validator_path = "%s.validator" % partial_path
+    if validator is None:
+      if os.path.exists(validator_path):
+        os.remove(validator_path)
+      return
+    validator_file = open(validator_path, "w")
+    try:
+      validator_file.write(validator)
+    finally:
+      validator_file.close()
+
+  def _discard_partial(self, partial_path):
+    for path in (partial_path, "%s.validator" % partial_path):
+      if os.path.exists(path):
+        os.remove(path)
+
+  def _write_index(self, url, content_digest):
+    (fd, temp_path) = tempfile.mkstemp(dir = self.index_dir)
+    try:
+      os.write(fd, content_digest)
+    finally:
+      os.close(fd)
+    os.rename(temp_path, os.path.join(self.index_dir, self._url_key(url)))
+
+  def _copy_stream(self, source, destination):
+    chunk = source.read(self.BUFFER_SIZE)
+    while chunk:
+      destination.write(chunk)
+      chunk = source.read(self.BUFFER_SIZE)
+
+  def _retrieve(self, source, partial_path):
+    scheme = urlparse.urlparse(source).scheme
+    # Local files and file:// URLs are copied directly.
+    if scheme in ("", "file"):
+      if scheme == "file":
+        source = urlparse.urlparse(source).path
+      self.log.info("Copying artifact from %s" % source)
+      self._discard_partial(partial_path)
+      shutil.copyfile(os.path.expanduser(source), partial_path)
+      return
+    # Resumes an interrupted download if a partial file is present and the
+    # server gave a validator to resume it against.
+    offset = 0
+    validator = self._read_validator(partial_path)
+    if os.path.exists(partial_path) and validator is not None:
+      offset = os.path.getsize(partial_path)
+    request = urllib2.Request(source)
+    if offset > 0:
+      self.log.info("Resuming download of %s at byte %s" % (source, offset))
+      request.add_header("Range", "bytes=%s-" % offset)
+      request.add_header("If-Range", validator)
+    else:
+      self.log.info("Downloading artifact from %s" % source)
+    response = urllib2.urlopen(request)
+    try:
+      # Servers send the whole file again if they ignore the range request or
+      # the artifact changed since the partial download began.
+      mode = "ab"
+      if offset == 0 or response.getcode() != 206:
+        mode = "wb"
+        self._write_validator(partial_path, response)
+      partial_file = open(partial_path, mode)
+      try:
+        self._copy_stream(response, partial_file)
+      finally:
+        partial_file.close()
+    finally:
+      response.close()
+
+  def fetch(self, url, checksum = None, mirrors = None):
+    """
+    Obtains the local path of the artifact at the supplied URL, retrieving it
+    from the mirrors or the URL itself if it is not yet cached.
+
+    @param url: the canonical URL of the artifact
+    @type url: str
+    @param checksum: the expected checksum as C{"algorithm:hexdigest"}, or a
+        bare SHA-256 hex digest (optional)
+    @type checksum: str
+    @param mirrors: local paths or URLs to try before the canonical URL
+    @type mirrors: list
+
+    @return: the path of the cached artifact
+    @rtype: str
+
+    @raise ArtifactCacheException: if the artifact could not be retrieved from
+        any source
+    """
+
+    (algorithm, digest) = self._parse_checksum(checksum)
+    url_key = self._url_key(url)
+    partial_path = os.path.join(self.partial_dir, url_key)
+    with FileLock(os.path.join(self.partial_dir, "%s.lock" % url_key)):
+      object_path = self._lookup(url, algorithm, digest)
+      if object_path is not None and self._touch(object_path):
+        self.log.debug("Artifact cache hit for %s: %s" % (url, object_path))
+        return object_path
+      failures = []
+      for source in list(mirrors or []) + [url]:
+        try:
+          self._retrieve(source, partial_path)
+          algorithms = set([self.CONTENT_ALGORITHM])
+          if algorithm is not None:
+            algorithms.add(algorithm)
+          digests = self._hash_file(partial_path, algorithms)
+          if algorithm is not None and digests[algorithm] != digest:
+            self._discard_partial(partial_path)
+            raise ArtifactChecksumException(
+                "Checksum mismatch for %s: expected %s:%s, got %s:%s" % (
+                    source, algorithm, digest, algorithm, digests[algorithm]))
+          object_path = self._object_path(digests[self.CONTENT_ALGORITHM])
+          os.rename(partial_path, object_path)
+          self._discard_partial(partial_path)
+          self._touch(object_path)
+          self._write_index(url, digests[self.CONTENT_ALGORITHM])
+          self.log.info("Cached %s as %s" % (url, object_path))
+          break
+        except Exception:
+          self.log.warning("Failed to retrieve %s:\n%s" % (source,
+              traceback.format_exc()))
+          failures.append(source)
+      else:
+        raise ArtifactCacheException(
+            "Unable to retrieve %s from any of: %s" % (url,
+                ", ".join(failures)))
+    self.evict(keep = object_path)
+    return object_path
+
+  def evict(self, keep = None):
+    """
+    Removes the least recently used artifacts until the cache fits within its
+    configured maximum size.  Artifacts used within the grace period are kept
+    even if the cache stays over its maximum size.
+
+    @param keep: the path of an artifact which must not be evicted (optional)
+    @type keep: str
+    """
+
+    if self.max_size is None:
+      return
+    with FileLock(self.lock_path):
+      entries = []
+      total_size = 0
+      for name in os.listdir(self.objects_dir):
+        object_path = os.path.join(self.objects_dir, name)
+        try:
+          stat = os.stat(object_path)
+        except OSError:
+          continue
+        entries.append((stat.st_mtime, stat.st_size, object_path))
+        total_size += stat.st_size
+      grace_deadline = time.time() - self.EVICTION_GRACE_PERIOD
+      for (mtime, size, object_path) in sorted(entries):
+        if total_size <= self.max_size or mtime > grace_deadline:
+          break
+        if object_path == keep:
+          continue
+        self.log.info("Evicting cached artifact: %s" % object_path)
+        try:
+          os.remove(object_path)
+          total_size -= size
+        except OSError:
+          self.log.debug("Failed to evict %s:\n%s" % (object_path,
+              traceback.format_exc()))
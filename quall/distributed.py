@@ -0,0 +1,552 @@
+# -*- coding: utf-8 -*-
+"""
+    quall.distributed
+    ~~~~~~~~~~~~~~~~~
+
+    Runs proboscis test groups across worker nodes reachable over SSH.
+
+    The test tree is packed into a compressed bundle named after the hash of
+    its contents and shipped to each worker at most once.  Each test group is
+    a shard; worker threads take shards from a shared queue, run them on their
+    node with C{--worker}, and stream per-test results back as they complete.
+    A shard whose worker fails is re-dispatched to another worker.  Tests that
+    depend on tests in other groups must be sharded together.
+
+    A worker that cannot be reached, loses its connection or exceeds the
+    shard or idle timeout is retired; a shard whose test process exits
+    abnormally is retried elsewhere without retiring the worker that ran it.
+
+    Any number of workers may point at the same host (e.g. a loopback SSH
+    server) as long as each has its own C{workdir}.
+
+    Example configuration::
+      distributed:
+        workers:
+          - host: localhost
+            workdir: /tmp/quall-worker-1
+          - host: localhost
+            workdir: /tmp/quall-worker-2
+"""
+
+
+import hashlib
+import json
+import logging
+import os
+import pipes
+import Queue
+import socket
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+import traceback
+
+import proboscis
+from proboscis import case as proboscis_case
+from proboscis import dependencies as proboscis_dependencies
+
+import quall.exceptions
+import quall.metrics
+
+
+# Marks result lines in a worker's stdout, which also carries harness output.
+RESULT_MARKER = "QUALL-RESULT "
+# Name the harness configuration file is shipped under inside the bundle.
+BUNDLE_CONFIG_NAME = "quall_worker_config.yml"
+
+
+class DistributedException(quall.exceptions.QuallException):
+  """
+  Base class for all distributed execution exceptions.
+  """
+
+  pass
+
+
+class WorkerFailedException(DistributedException):
+  """
+  Signifies that a worker node failed while running a shard, as opposed to
+  the shard's tests failing.
+  """
+
+  pass
+
+
+class ShardFailedException(DistributedException):
+  """
+  Signifies that a shard's test process ran on its worker but exited before
+  finishing, e.g. because a test crashed the interpreter.
+  """
+
+  pass
+
+
+def _test_name(test):
+  """
+  @return: the test's name qualified by its module and class, so that
+      same-named methods in different classes stay distinct
+  @rtype: str
+  """
+
+  # Nose wraps each proboscis test case in a nose.case.Test.
+  root = getattr(test, "test", test)
+  case = getattr(root, "__proboscis_case__", None)
+  if case is None:
+    return str(test)
+  home = case.entry.home
+  if isinstance(home, type):
+    # A unittest.TestCase class, which runs one test per method.
+    return "%s.%s.%s" % (home.__module__, home.__name__,
+        root._testMethodName)
+  if case.entry.method is not None:
+    owner = case.entry.method.im_class
+    return "%s.%s.%s" % (owner.__module__, owner.__name__, home.__name__)
+  return "%s.%s" % (home.__module__, home.__name__)
+
+
+def _emit(event):
+  # Writes to the real stdout, since nose captures sys.stdout during tests.
+  sys.__stdout__.write("%s%s\n" % (RESULT_MARKER, json.dumps(event)))
+  sys.__stdout__.flush()
+
+
+class _WorkerTestResult(proboscis_case.TestResult):
+  """
+  Proboscis test result that also emits each outcome as a marked JSON line.
+  """
+
+  def _emit_outcome(self, test, outcome, details = None):
+    _emit({"event": "result", "test": _test_name(test), "outcome": outcome,
+        "details": details, "time": time.time()})
+
+  def startTest(self, test):
+    quall.metrics.registry.set_context(test = _test_name(test))
+    proboscis_case.TestResult.startTest(self, test)
+
+  def stopTest(self, test):
+    proboscis_case.TestResult.stopTest(self, test)
+    quall.metrics.registry.set_context(test = None)
+
+  def addSuccess(self, test):
+    proboscis_case.TestResult.addSuccess(self, test)
+    self._emit_outcome(test, "pass")
+
+  def addFailure(self, test, err):
+    proboscis_case.TestResult.addFailure(self, test, err)
+    self._emit_outcome(test, "fail", self._exc_info_to_string(err, test))
+
+  def addError(self, test, err):
+    proboscis_case.TestResult.addError(self, test, err)
+    # Nose reports skipped tests as errors of a registered error class.
+    if issubclass(err[0], proboscis_dependencies.ExternalSkipTest):
+      self._emit_outcome(test, "skip", str(err[1]))
+    else:
+      self._emit_outcome(test, "error", self._exc_info_to_string(err, test))
+
+  def addSkip(self, test, reason):
+    proboscis_case.TestResult.addSkip(self, test, reason)
+    self._emit_outcome(test, "skip", str(reason))
+
+
+def _make_worker_result(self):
+  if proboscis_dependencies.use_nose:
+    return _WorkerTestResult(self.stream, self.descriptions, self.verbosity,
+        self.config)
+  return _WorkerTestResult(self.stream, self.descriptions, self.verbosity)
+
+
+_WorkerTestRunner = type("_WorkerTestRunner",
+    (proboscis_dependencies.TextTestRunner,),
+    {"_makeResult": _make_worker_result})
+
+
+def run_worker(groups):
+  """
+  Runs the requested proboscis groups on this node, writing one marked JSON
+  line per test result to stdout, then this process's metrics (if enabled)
+  and a final C{done} line.  Human-readable test output goes to stderr.
+
+  @param groups: the proboscis groups to run
+  @type groups: list of str
+  """
+
+  _emit({"event": "start", "groups": groups, "time": time.time()})
+  try:
+    proboscis.TestProgram(groups = groups, argv = [sys.argv[0]],
+        testRunner = _WorkerTestRunner(sys.stderr, verbosity = 2),
+        stream = sys.stderr).run_and_exit()
+  except SystemExit:
+    pass
+  if quall.metrics.registry.enabled:
+    _emit({"event": "metrics", "state": quall.metrics.registry.get_state()})
+  _emit({"event": "done", "time": time.time()})
+
+
+def build_bundle(base_dir, paths, config_file):
+  """
+  Packs the test tree into a gzipped tarball named after the hash of its
+  contents, so unchanged trees hash identically across runs.
+
+  @param base_dir: the directory the bundle paths are relative to
+  @type base_dir: str
+  @param paths: files and directories to include, relative to base_dir
+  @type paths: list of str
+  @param config_file: the harness configuration file to ship
+  @type config_file: str
+
+  @return: (bundle_path, content_hash)
+  @rtype: tuple
+  """
+
+  files = []
+  for path in paths:
+    full_path = os.path.join(base_dir, path)
+    if os.path.isfile(full_path):
+      files.append(path)
+      continue
+    for (dir_path, dir_names, file_names) in os.walk(full_path):
+      dir_names.sort()
+      for file_name in sorted(file_names):
+        if file_name.endswith((".pyc", ".pyo")):
+          continue
+        files.append(os.path.relpath(os.path.join(dir_path, file_name),
+            base_dir))
+  entries = [(os.path.join(base_dir, name), name) for name in sorted(files)]
+  entries.append((config_file, BUNDLE_CONFIG_NAME))
+  content_hash = hashlib.sha256()
+  for (full_path, name) in entries:
+    content_hash.update(name)
+    content_hash.update("\0")
+    bundle_file = open(full_path, "rb")
+    try:
+      content_hash.update(hashlib.sha256(bundle_file.read()).digest())
+    finally:
+      bundle_file.close()
+  (fd, bundle_path) = tempfile.mkstemp(suffix = ".tar.gz")
+  os.close(fd)
+  bundle = tarfile.open(bundle_path, "w:gz")
+  try:
+    for (full_path, name) in entries:
+      bundle.add(full_path, arcname = name)
+  finally:
+    bundle.close()
+  return (bundle_path, content_hash.hexdigest())
+
+
+class _Shard(object):
+
+  def __init__(self, groups):
+    self.groups = groups
+    self.attempts = 0
+    self.results = []
+    self.workers = []
+    self.error = None
+    # Why the most recent attempt failed, reported if the shard is given up.
+    self.last_error = None
+
+  def __str__(self):
+    return ",".join(self.groups)
+
+
+class DistributedRunner(object):
+  """Dispatches proboscis group shards to worker nodes over SSH and merges
+  their results into a single report.
+  """
+
+  DEFAULT_WORKDIR = os.path.join(tempfile.gettempdir(), "quall-worker")
+  DEFAULT_BUNDLE_PATHS = ["quall", "tests", "run_tests.py"]
+  DEFAULT_COMMAND = "python run_tests.py"
+  DEFAULT_MAX_ATTEMPTS = 3
+  # Seconds a shard may run, and may go without producing any output, before
+  # its worker is presumed hung or partitioned.
+  DEFAULT_SHARD_TIMEOUT = 3600
+  DEFAULT_IDLE_TIMEOUT = 600
+  # Seconds each read of a worker's output blocks for.
+  POLL_INTERVAL = 1.0
+  BUFFER_SIZE = 32768
+  # Bytes of a worker's stderr kept for error messages.
+  STDERR_TAIL_SIZE = 4096
+
+  log = logging.getLogger("quall.distributed")
+
+  def __init__(self, harness, shards):
+    """
+    @param harness: the harness instance, which must derive from
+        L{quall.mixins.ssh.SSHClientMixin}
+    @type harness: L{quall.base.QuallBase}
+    @param shards: the group lists to dispatch, one per shard
+    @type shards: list of list of str
+
+    @raise DistributedException: if the harness cannot run SSH commands or
+        no workers are configured
+    """
+
+    if not hasattr(harness, "ssh_command"):
+      raise DistributedException(
+          "Distributed mode requires a harness derived from SSHClientMixin")
+    self.harness = harness
+    self.config = harness.config.get("distributed") or {}
+    self.workers = [self._worker_config(index, worker)
+        for (index, worker) in enumerate(self.config.get("workers") or [])]
+    if not self.workers:
+      raise DistributedException("No distributed workers are configured")
+    self.shards = [_Shard(groups) for groups in shards]
+    self.max_attempts = int(self.config.get("max_attempts",
+        self.DEFAULT_MAX_ATTEMPTS))
+    self.shard_timeout = float(self.config.get("shard_timeout",
+        self.DEFAULT_SHARD_TIMEOUT))
+    self.idle_timeout = float(self.config.get("idle_timeout",
+        self.DEFAULT_IDLE_TIMEOUT))
+    self._queue = Queue.Queue()
+    self._lock = threading.Lock()
+    self._outstanding = len(self.shards)
+    self._live_workers = 0
+
+  def _worker_config(self, index, worker):
+    worker = dict(worker)
+    worker.setdefault("name", "worker-%s" % index)
+    worker.setdefault("username", "root")
+    worker.setdefault("password", "")
+    worker.setdefault("port", 22)
+    worker.setdefault("workdir", self.config.get("workdir",
+        self.DEFAULT_WORKDIR))
+    worker.setdefault("command", self.config.get("command",
+        self.DEFAULT_COMMAND))
+    return worker
+
+  def _ssh(self, worker, command):
+    return self.harness.ssh_command(worker["host"], command,
+        username = worker["username"], password = worker["password"],
+        ssh_port = worker["port"])
+
+  def _bootstrap(self, worker, bundle_path, content_hash):
+    # Ships and unpacks the bundle unless this worker already has it.
+    remote_dir = "%s/%s" % (worker["workdir"], content_hash)
+    (exit_code, stdout, stderr) = self._ssh(worker,
+        "test -f %s" % pipes.quote("%s/.complete" % remote_dir))
+    if exit_code == 0:
+      self.log.info("%s already has bundle %s" % (worker["name"],
+          content_hash))
+      return remote_dir
+    self.log.info("Shipping bundle %s to %s" % (content_hash, worker["name"]))
+    remote_bundle = "%s.tar.gz" % remote_dir
+    self._ssh(worker, "mkdir -p %s" % pipes.quote(worker["workdir"]))
+    self.harness.put_remote_file(worker["host"], bundle_path, remote_bundle,
+        username = worker["username"], password = worker["password"],
+        ssh_port = worker["port"])
+    (exit_code, stdout, stderr) = self._ssh(worker,
+        "mkdir -p %(dir)s && tar -xzf %(bundle)s -C %(dir)s && "
+        "rm -f %(bundle)s && touch %(dir)s/.complete" % {
+            "dir": pipes.quote(remote_dir),
+            "bundle": pipes.quote(remote_bundle)})
+    if exit_code != 0:
+      raise WorkerFailedException("Failed to unpack bundle on %s: %s" % (
+          worker["name"], stderr))
+    return remote_dir
+
+  def _handle_event(self, worker, shard, line, received):
+    if not line.startswith(RESULT_MARKER):
+      return
+    event = json.loads(line[len(RESULT_MARKER):])
+    if event["event"] == "result":
+      event["worker"] = worker["name"]
+      event["shard"] = str(shard)
+      received["results"].append(event)
+      self.log.info("[%s] %s: %s" % (worker["name"], event["test"],
+          event["outcome"]))
+    elif event["event"] == "metrics":
+      received["metrics"] = event["state"]
+    elif event["event"] == "done":
+      received["done"] = True
+
+  def _merge_metrics(self, worker, shard, state):
+    # Folds a worker's metrics, labelled by test, into this process's export.
+    try:
+      quall.metrics.registry.merge_state(state, worker = worker["name"])
+    except ValueError:
+      self.log.warning("Failed to merge metrics for shard %s from %s:\n%s" % (
+          shard, worker["name"], traceback.format_exc()))
+
+  def _drain_stderr(self, channel, stderr_tail):
+    # Reads all stderr the channel has buffered, keeping only its tail.
+    drained = False
+    while channel.recv_stderr_ready():
+      stderr_tail = (stderr_tail + channel.recv_stderr(
+          self.BUFFER_SIZE))[-self.STDERR_TAIL_SIZE:]
+      drained = True
+    return (stderr_tail, drained)
+
+  def _run_shard(self, worker, remote_dir, shard):
+    # Streams marked result lines back while the shard runs.  The worker's
+    # stderr, which carries test output and harness logging, is drained as it
+    # arrives: paramiko only reopens the channel window as data is read, so
+    # unread stderr would eventually block the worker.
+    command = "cd %s && %s --worker -e %s -c %s -g %s" % (
+        pipes.quote(remote_dir), worker["command"],
+        pipes.quote(self.harness.options.environment), BUNDLE_CONFIG_NAME,
+        pipes.quote(",".join(shard.groups)))
+    self.log.info("Running shard %s on %s" % (shard, worker["name"]))
+    received = {"results": [], "metrics": None, "done": False}
+    stdout = ""
+    stderr_tail = ""
+    start = time.time()
+    last_output = start
+    transport = self.harness.get_ssh_transport(worker["host"],
+        worker["username"], worker["password"], worker["port"])
+    try:
+      channel = transport.open_session()
+      channel.settimeout(self.POLL_INTERVAL)
+      channel.exec_command(command)
+      while True:
+        (stderr_tail, drained) = self._drain_stderr(channel, stderr_tail)
+        if drained:
+          last_output = time.time()
+        try:
+          data = channel.recv(self.BUFFER_SIZE)
+        except socket.timeout:
+          data = None
+        now = time.time()
+        if data == "":
+          break
+        if data is not None:
+          last_output = now
+          stdout += data
+          while "\n" in stdout:
+            (line, stdout) = stdout.split("\n", 1)
+            self._handle_event(worker, shard, line, received)
+        if now - start >= self.shard_timeout:
+          raise WorkerFailedException(
+              "%s did not finish shard %s within %s seconds" % (
+                  worker["name"], shard, self.shard_timeout))
+        if now - last_output >= self.idle_timeout:
+          raise WorkerFailedException(
+              "%s produced no output for %s seconds while running shard %s" % (
+                  worker["name"], self.idle_timeout, shard))
+      if stdout:
+        self._handle_event(worker, shard, stdout, received)
+      # Collects whatever the worker wrote to stderr as it exited.
+      (stderr_tail, drained) = self._drain_stderr(channel, stderr_tail)
+      # Paramiko reports -1 if the channel closed without an exit status.
+      exit_code = channel.recv_exit_status()
+      channel.close()
+      if exit_code == -1 or not transport.is_active():
+        raise WorkerFailedException("Lost connection to %s while running "
+            "shard %s" % (worker["name"], shard))
+    finally:
+      transport.close()
+    if not received["done"]:
+      raise ShardFailedException(
+          "%s exited with status %s before finishing shard %s:\n%s" % (
+              worker["name"], exit_code, shard, stderr_tail))
+    if received["metrics"] is not None:
+      self._merge_metrics(worker, shard, received["metrics"])
+    return received["results"]
+
+  def _finish_shard(self, shard, results = None, error = None):
+    with self._lock:
+      shard.results = results or []
+      shard.error = error
+      self._outstanding -= 1
+
+  def _work(self, worker, bundle_path, content_hash):
+    try:
+      remote_dir = self._bootstrap(worker, bundle_path, content_hash)
+    except Exception:
+      self.log.warning("Failed to bootstrap %s:\n%s" % (worker["name"],
+          traceback.format_exc()))
+      self._retire_worker()
+      return
+    while True:
+      with self._lock:
+        if self._outstanding == 0:
+          return
+      try:
+        shard = self._queue.get(timeout = 0.1)
+      except Queue.Empty:
+        continue
+      shard.attempts += 1
+      shard.workers.append(worker["name"])
+      try:
+        self._finish_shard(shard, results = self._run_shard(worker,
+            remote_dir, shard))
+      except ShardFailedException as e:
+        # The worker itself is healthy; only the shard's process failed.
+        self.log.warning("Shard %s failed on %s:\n%s" % (shard,
+            worker["name"], traceback.format_exc()))
+        shard.last_error = str(e)
+        self._retry_shard(shard)
+      except Exception as e:
+        self.log.warning("%s failed running shard %s:\n%s" % (worker["name"],
+            shard, traceback.format_exc()))
+        shard.last_error = str(e)
+        self._retry_shard(shard)
+        self._retire_worker()
+        return
+
+  def _retry_shard(self, shard):
+    if shard.attempts >= self.max_attempts:
+      self._finish_shard(shard, error = "Gave up after %s attempts: %s" % (
+          shard.attempts, shard.last_error))
+    else:
+      self.log.info("Re-dispatching shard %s" % shard)
+      self._queue.put(shard)
+
+  def _retire_worker(self):
+    # Fails every remaining shard once no worker is left to run them.
+    with self._lock:
+      self._live_workers -= 1
+      if self._live_workers > 0:
+        return
+    while True:
+      try:
+        shard = self._queue.get_nowait()
+      except Queue.Empty:
+        return
+      self._finish_shard(shard, error = "No live workers remained")
+
+  def run(self):
+    """
+    Bootstraps every worker, runs every shard and merges the results.
+
+    @return: the merged report
+    @rtype: dict
+    """
+
+    start = time.time()
+    (bundle_path, content_hash) = build_bundle(os.getcwd(),
+        self.config.get("bundle_paths", self.DEFAULT_BUNDLE_PATHS),
+        self.harness.options.config_file)
+    try:
+      for shard in self.shards:
+        self._queue.put(shard)
+      self._live_workers = len(self.workers)
+      threads = [threading.Thread(target = self._work,
+          args = (worker, bundle_path, content_hash))
+          for worker in self.workers]
+      for thread in threads:
+        thread.start()
+      for thread in threads:
+        thread.join()
+    finally:
+      os.remove(bundle_path)
+    return self._report(time.time() - start)
+
+  def _report(self, elapsed):
+    results = []
+    summary = {"pass": 0, "fail": 0, "error": 0, "skip": 0}
+    shards = []
+    for shard in self.shards:
+      results.extend(shard.results)
+      for result in shard.results:
+        summary[result["outcome"]] = summary.get(result["outcome"], 0) + 1
+      if shard.error is not None:
+        summary["error"] += 1
+      shards.append({"groups": shard.groups, "attempts": shard.attempts,
+          "workers": shard.workers, "error": shard.error})
+    self.log.info("Distributed run finished in %.1f seconds: %s" % (elapsed,
+        ", ".join("%s=%s" % item for item in sorted(summary.items()))))
+    return {"elapsed": elapsed, "summary": summary, "shards": shards,
+        "results": results,
+        "success": summary["fail"] == 0 and summary["error"] == 0}
@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+"""
+    quall.metrics
+    ~~~~~~~~~~~~~
+
+    Provides a lightweight in-process registry of counters, gauges and
+    histograms describing where harness time goes.
+
+    The registry is disabled by default; while disabled every recording call
+    returns immediately and L{MetricsRegistry.timer} hands back a shared no-op
+    context manager.  Samples carry the labels they were recorded with plus
+    any context labels (such as the current test) set on the calling thread.
+
+    Example::
+      with quall.metrics.registry.timer("quall_ssh_command_seconds",
+          host = hostname):
+        ...
+      quall.metrics.registry.write_prometheus("metrics.prom")
+"""
+
+
+import bisect
+import json
+import threading
+import time
+
+
+class _NullTimer(object):
+  """
+  Context manager used in place of a timer while metrics are disabled.
+  """
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, tb):
+    return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer(object):
+
+  def __init__(self, registry, name, labels):
+    self.registry = registry
+    self.name = name
+    self.labels = labels
+
+  def __enter__(self):
+    self.start = time.time()
+    return self
+
+  def __exit__(self, exc_type, exc_value, tb):
+    labels = self.labels
+    if exc_type is not None:
+      labels = dict(labels, error = exc_type.__name__)
+    self.registry.observe(self.name, time.time() - self.start, **labels)
+    return False
+
+
+class _Histogram(object):
+  """
+  Fixed-bucket histogram; observing a value is a bisect and a few additions.
+  """
+
+  __slots__ = ("bounds", "buckets", "count", "sum", "min", "max")
+
+  def __init__(self, bounds):
+    self.bounds = bounds
+    self.buckets = [0] * (len(bounds) + 1)
+    self.count = 0
+    self.sum = 0.0
+    self.min = None
+    self.max = None
+
+  def observe(self, value):
+    self.buckets[bisect.bisect_left(self.bounds, value)] += 1
+    self.count += 1
+    self.sum += value
+    if self.min is None or value < self.min:
+      self.min = value
+    if self.max is None or value > self.max:
+      self.max = value
+
+  def quantile(self, q):
+    # Interpolates linearly within the bucket holding the requested rank.
+    if self.count == 0:
+      return None
+    rank = q * self.count
+    seen = 0
+    for (index, bucket_count) in enumerate(self.buckets):
+      if bucket_count and seen + bucket_count >= rank:
+        lower = self.min
+        if index > 0:
+          lower = max(self.bounds[index - 1], self.min)
+        upper = self.max
+        if index < len(self.bounds):
+          upper = min(self.bounds[index], self.max)
+        return lower + (upper - lower) * (rank - seen) / bucket_count
+      seen += bucket_count
+    return self.max
+
+
+class MetricsRegistry(object):
+  """Holds every metric recorded in this process.
+  """
+
+  # Seconds; spans sub-millisecond driver commands to minute-long commands.
+  DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+      1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+  def __init__(self, enabled = False, buckets = None):
+    self.enabled = enabled
+    self.buckets = tuple(buckets or self.DEFAULT_BUCKETS)
+    self._lock = threading.Lock()
+    self._local = threading.local()
+    self._counters = {}
+    self._gauges = {}
+    self._histograms = {}
+
+  def _key(self, name, labels):
+    context = getattr(self._local, "labels", None)
+    if context:
+      labels = dict(context, **labels)
+    return (name, tuple(sorted(labels.items())))
+
+  def set_context(self, **labels):
+    """
+    Sets labels, such as C{test}, added to every sample recorded by the
+    calling thread.  Passing a label as None removes it.
+    """
+
+    context = dict(getattr(self._local, "labels", None) or {})
+    for (label, value) in labels.items():
+      if value is None:
+        context.pop(label, None)
+      else:
+        context[label] = value
+    self._local.labels = context
+
+  def increment(self, name, value = 1, **labels):
+    if not self.enabled:
+      return
+    key = self._key(name, labels)
+    with self._lock:
+      self._counters[key] = self._counters.get(key, 0) + value
+
+  def set_gauge(self, name, value, **labels):
+    if not self.enabled:
+      return
+    key = self._key(name, labels)
+    with self._lock:
+      self._gauges[key] = value
+
+  def observe(self, name, value, **labels):
+    if not self.enabled:
+      return
+    key = self._key(name, labels)
+    with self._lock:
+      histogram = self._histograms.get(key)
+      if histogram is None:
+        histogram = self._histograms[key] = _Histogram(self.buckets)
+      histogram.observe(value)
+
+  def timer(self, name, **labels):
+    """
+    @return: a context manager observing its duration in seconds into the
+        named histogram, labelled with the exception type if one escapes
+    """
+
+    if not self.enabled:
+      return _NULL_TIMER
+    return _Timer(self, name, labels)
+
+  def reset(self):
+    with self._lock:
+      self._counters = {}
+      self._gauges = {}
+      self._histograms = {}
+
+  def get_state(self):
+    """
+    @return: every sample in a JSON-serializable form that another registry
+        can L{merge_state}, e.g. to ship a worker process's metrics back to
+        its coordinator
+    @rtype: dict
+    """
+
+    with self._lock:
+      return {
+        "counters": [[name, dict(labels), value]
+            for ((name, labels), value) in self._counters.items()],
+        "gauges": [[name, dict(labels), value]
+            for ((name, labels), value) in self._gauges.items()],
+        "histograms": [[name, dict(labels), {"bounds": list(histogram.bounds),
+            "buckets": histogram.buckets, "count": histogram.count,
+            "sum": histogram.sum, "min": histogram.min, "max": histogram.max}]
+            for ((name, labels), histogram) in self._histograms.items()],
+      }
+
+  def merge_state(self, state, **labels):
+    """
+    Adds the samples from another registry's L{get_state} to this one.
+    Counters and histograms are summed and gauges overwritten.
+
+    @param state: the state to merge
+    @type state: dict
+    @param labels: extra labels, such as C{worker}, added to every sample
+
+    @raise ValueError: if a histogram's buckets differ from those already
+        recorded under the same name and labels
+    """
+
+    if not self.enabled:
+      return
+    def key(name, sample_labels):
+      return (name, tuple(sorted(dict(sample_labels, **labels).items())))
+    with self._lock:
+      for (name, sample_labels, value) in state["counters"]:
+        counter_key = key(name, sample_labels)
+        self._counters[counter_key] = self._counters.get(counter_key, 0) + value
+      for (name, sample_labels, value) in state["gauges"]:
+        self._gauges[key(name, sample_labels)] = value
+      for (name, sample_labels, sample) in state["histograms"]:
+        histogram_key = key(name, sample_labels)
+        histogram = self._histograms.get(histogram_key)
+        if histogram is None:
+          histogram = self._histograms[histogram_key] = _Histogram(
+              tuple(sample["bounds"]))
+        elif list(histogram.bounds) != list(sample["bounds"]):
+          raise ValueError("Cannot merge histogram %s with different buckets" %
+              name)
+        histogram.buckets = [count + other for (count, other)
+            in zip(histogram.buckets, sample["buckets"])]
+        histogram.count += sample["count"]
+        histogram.sum += sample["sum"]
+        for (attribute, pick) in (("min", min), ("max", max)):
+          values = [value for value in (getattr(histogram, attribute),
+              sample[attribute]) if value is not None]
+          if values:
+            setattr(histogram, attribute, pick(values))
+
+  def _format_labels(self, labels, extra = ()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+      return ""
+    return "{%s}" % ",".join('%s="%s"' % (label, str(value).replace("\\",
+        "\\\\").replace("\"", "\\\"").replace("\n", "\\n"))
+        for (label, value) in pairs)
+
+  def to_prometheus(self):
+    """
+    @return: every metric in the Prometheus text exposition format
+    @rtype: str
+    """
+
+    lines = []
+    with self._lock:
+      for (metrics, metric_type) in ((self._counters, "counter"),
+          (self._gauges, "gauge")):
+        for name in sorted(set(key[0] for key in metrics)):
+          lines.append("# TYPE %s %s" % (name, metric_type))
+          for ((key_name, labels), value) in sorted(metrics.items()):
+            if key_name == name:
+              lines.append("%s%s %s" % (name, self._format_labels(labels),
+                  value))
+      for name in sorted(set(key[0] for key in self._histograms)):
+        lines.append("# TYPE %s histogram" % name)
+        for ((key_name, labels), histogram) in sorted(
+            self._histograms.items()):
+          if key_name != name:
+            continue
+          cumulative = 0
+          for (bound, bucket_count) in zip(
+              list(histogram.bounds) + ["+Inf"], histogram.buckets):
+            cumulative += bucket_count
+            lines.append("%s_bucket%s %s" % (name,
+                self._format_labels(labels, [("le", bound)]), cumulative))
+          lines.append("%s_sum%s %s" % (name, self._format_labels(labels),
+              histogram.sum))
+          lines.append("%s_count%s %s" % (name, self._format_labels(labels),
+              histogram.count))
+    return "\n".join(lines) + "\n"
+
+  def summary(self):
+    """
+    @return: counters, gauges and per-histogram count, sum, min, max, mean,
+        p50 and p95, each as a list of samples with their labels
+    @rtype: dict
+    """
+
+    summary = {"counters": [], "gauges": [], "histograms": []}
+    with self._lock:
+      for ((name, labels), value) in sorted(self._counters.items()):
+        summary["counters"].append({"name": name, "labels": dict(labels),
+            "value": value})
+      for ((name, labels), value) in sorted(self._gauges.items()):
+        summary["gauges"].append({"name": name, "labels": dict(labels),
+            "value": value})
+      for ((name, labels), histogram) in sorted(self._histograms.items()):
+        summary["histograms"].append({"name": name, "labels": dict(labels),
+            "count": histogram.count, "sum": histogram.sum,
+            "min": histogram.min, "max": histogram.max,
+            "mean": histogram.sum / histogram.count,
+            "p50": histogram.quantile(0.5), "p95": histogram.quantile(0.95)})
+    return summary
+
+  def write_prometheus(self, path):
+    metrics_file = open(path, "w")
+    try:
+      metrics_file.write(self.to_prometheus())
+    finally:
+      metrics_file.close()
+
+  def write_json(self, path):
+    metrics_file = open(path, "w")
+    try:
+      json.dump(self.summary(), metrics_file, indent = 2)
+    finally:
+      metrics_file.close()
+
+
+# The registry every mixin records into.
+registry = MetricsRegistry()
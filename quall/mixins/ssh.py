@@ -18,9 +18,12 @@ import logging
 import os
 import paramiko
 import socket
+import time
 import traceback
 
 import quall.exceptions
+import quall.metrics
+import quall.resources
 
 
 class SSHException(quall.exceptions.QuallException):
@@ -193,6 +196,52 @@ class SSHClientMixin(object):
           "Failed to authenticate with password:\n%s" % traceback.format_exc())
     return False
 
+  def _open_ssh_transport(self, hostname, username, password, ssh_port):
+    # Hands out a shared transport if transports are scoped in configuration.
+    scope = self.config["ssh"].get("transport_scope")
+    if scope is None:
+      return self.get_ssh_transport(hostname, username, password, ssh_port)
+    return self.get_shared_ssh_transport(hostname, username, password,
+        ssh_port, scope)
+
+  def _close_ssh_transport(self, transport, hostname, username, ssh_port):
+    # Shared transports stay open until their scope ends.
+    if self.config["ssh"].get("transport_scope") is None:
+      transport.close()
+    else:
+      self.resources.release(("ssh", username, hostname, ssh_port))
+
+  def get_shared_ssh_transport(self, hostname, username = "root",
+      password = "", ssh_port = 22, scope = quall.resources.SESSION):
+    """
+    Obtains a C{paramiko.Transport} for the requested host which is shared by
+    every caller until the end of the requested resource scope.  Inactive
+    transports are transparently reopened.  Each call takes a reference which
+    should be given back with C{self.resources.release}.
+
+    @param hostname: the hostname of the remote host
+    @type hostname: str
+    @param username: the username to connect to the remote host as
+    @type username: str
+    @param password: the password to use for authentication (optional)
+    @type password: str
+    @param ssh_port: the SSH port of the remote host, if not 22
+    @type ssh_port: int
+    @param scope: the resource scope to share the transport within
+    @type scope: str
+
+    @return: a shared C{paramiko.Transport}
+    @rtype: paramiko.Transport
+
+    @raise SSHException: if an error occurs during client initialization
+    """
+
+    return self.resources.acquire(scope,
+        ("ssh", username, hostname, ssh_port),
+        lambda: self.get_ssh_transport(hostname, username, password, ssh_port),
+        finalizer = lambda transport: transport.close(),
+        validator = lambda transport: transport.is_active(), retain = True)
+
   def get_ssh_transport(self, hostname, username = "root", password = "",
       ssh_port = 22):
     """
@@ -214,6 +263,7 @@ class SSHClientMixin(object):
     @raise SSHException: if an error occurs during client initialization
     """
 
+    start = time.time()
     try:
       self.log.debug("Opening SSH connection to %s@%s" % (username, hostname))
       # Opens a socket to the remote host's SSH port.
@@ -231,11 +281,17 @@ class SSHClientMixin(object):
       self._authenticate_ssh_transport(transport, username, password)
       self.log.debug(
           "Successfully authenticated to %s@%s" % (username, hostname))
+      quall.metrics.registry.observe("quall_ssh_connect_seconds",
+          time.time() - start, host = hostname)
       return transport
     except socket.error:
+      quall.metrics.registry.increment("quall_ssh_errors_total",
+          host = hostname, operation = "connect")
       raise SSHException("Unable to open a connection to %s:%s" % (hostname,
           ssh_port))
     except paramiko.SSHException:
+      quall.metrics.registry.increment("quall_ssh_errors_total",
+          host = hostname, operation = "connect")
       raise SSHException(
           "Error while opening SSH connection:\n%s" % traceback.format_exc())
 
@@ -273,11 +329,13 @@ class SSHClientMixin(object):
 
     channel = None
     transport = None
+    start = time.time()
     try:
       self.log.info(
           "Executing SSH command against %s@%s: %s" % (username, hostname,
               command))
-      transport = self.get_ssh_transport(hostname, username, password)
+      transport = self._open_ssh_transport(hostname, username, password,
+          ssh_port)
       channel = transport.open_session()
       # Starts a pseudo-terminal on the remote host if desired.
       if get_pty:
@@ -309,10 +367,14 @@ class SSHClientMixin(object):
       self.log.info("Stderr:\n%s" % stderr_text)
       return (exit_code, stdout_text, stderr_text)
     except socket.timeout:
+      quall.metrics.registry.increment("quall_ssh_errors_total",
+          host = hostname, operation = "timeout")
       raise SSHTimeoutException(
           "Reached timeout of %s seconds while executing SSH command against "
           "%s@%s: %s" % (timeout, username, hostname, command))
     except Exception:
+      quall.metrics.registry.increment("quall_ssh_errors_total",
+          host = hostname, operation = "command")
       raise SSHException(
           "Failed to execute SSH command against %s@%s: %s\n%s" % (username,
               hostname, command, traceback.format_exc()))
@@ -320,17 +382,23 @@ class SSHClientMixin(object):
       if channel is not None:
         channel.close()
       if transport is not None:
-        transport.close()
+        self._close_ssh_transport(transport, hostname, username, ssh_port)
+      quall.metrics.registry.observe("quall_ssh_command_seconds",
+          time.time() - start, host = hostname)
 
   def get_remote_file(self, hostname, remote_path, local_path,
       username = "root", password = "", ssh_port = 22):
     transport = None
     sftp = None
+    start = time.time()
     try:
-      transport = self.get_ssh_transport(hostname, username, password, ssh_port)
+      transport = self._open_ssh_transport(hostname, username, password,
+          ssh_port)
       sftp = paramiko.SFTPClient.from_transport(transport)
       sftp.get(remote_path, local_path)
     except paramiko.SFTPError:
+      quall.metrics.registry.increment("quall_ssh_errors_total",
+          host = hostname, operation = "sftp_get")
       raise SFTPException(
           "Failed to get %s from %s@%s:%s\n%s" % (local_path,
               username, hostname, remote_path, traceback.format_exc()))
@@ -338,17 +406,23 @@ class SSHClientMixin(object):
       if sftp is not None:
         sftp.close()
       if transport is not None:
-        transport.close()
+        self._close_ssh_transport(transport, hostname, username, ssh_port)
+      quall.metrics.registry.observe("quall_sftp_seconds",
+          time.time() - start, host = hostname, operation = "get")
 
   def get_remote_file_contents(self, hostname, remote_path,
       username = "root", password = "", ssh_port = 22):
     transport = None
     sftp = None
+    start = time.time()
     try:
-      transport = self.get_ssh_transport(hostname, username, password, ssh_port)
+      transport = self._open_ssh_transport(hostname, username, password,
+          ssh_port)
       sftp = paramiko.SFTPClient.from_transport(transport)
       return sftp.open(remote_path).read()
     except paramiko.SFTPError:
+      quall.metrics.registry.increment("quall_ssh_errors_total",
+          host = hostname, operation = "sftp_read")
       raise SFTPException(
           "Failed to get %s@%s:%s\n%s" % (username, hostname, remote_path,
               traceback.format_exc()))
@@ -356,17 +430,23 @@ class SSHClientMixin(object):
       if sftp is not None:
         sftp.close()
       if transport is not None:
-        transport.close()
+        self._close_ssh_transport(transport, hostname, username, ssh_port)
+      quall.metrics.registry.observe("quall_sftp_seconds",
+          time.time() - start, host = hostname, operation = "read")
 
   def put_remote_file(self, hostname, local_path, remote_path,
       username = "root", password = None, ssh_port = 22):
     transport = None
     sftp = None
+    start = time.time()
     try:
-      transport = self.get_ssh_transport(hostname, username, password, ssh_port)
+      transport = self._open_ssh_transport(hostname, username, password,
+          ssh_port)
       sftp = paramiko.SFTPClient.from_transport(transport)
       sftp.put(local_path, remote_path)
     except paramiko.SFTPError:
+      quall.metrics.registry.increment("quall_ssh_errors_total",
+          host = hostname, operation = "sftp_put")
       raise SFTPException(
           "Failed to send %s to %s@%s:%s\n%s" % (local_path,
               username, hostname, remote_path, traceback.format_exc()))
@@ -374,5 +454,7 @@ class SSHClientMixin(object):
       if sftp is not None:
         sftp.close()
       if transport is not None:
-        transport.close()
+        self._close_ssh_transport(transport, hostname, username, ssh_port)
+      quall.metrics.registry.observe("quall_sftp_seconds",
+          time.time() - start, host = hostname, operation = "put")
 
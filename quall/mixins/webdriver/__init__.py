@@ -10,14 +10,26 @@
 """
 
 
-import shutil
-import tempfile
+import inspect
+import time
 import traceback
-import urllib2
+import urlparse
 
-import selenium
+import selenium.common.exceptions
+import selenium.webdriver
+from selenium.webdriver.common.by import By
 
 import quall.exceptions
+import quall.metrics
+import quall.resources
+from quall.mixins.webdriver.abstractions import WebDriverAbstractions
+from quall.mixins.webdriver.pool import WebDriverPool
+from quall.mixins.webdriver.server import SeleniumServer
+from quall.mixins.webdriver.waits import Gone
+from quall.mixins.webdriver.waits import Present
+from quall.mixins.webdriver.waits import TextMatches
+from quall.mixins.webdriver.waits import Visible
+from quall.mixins.webdriver.waits import WaitStatistics
 
 
 class SeleniumException(quall.exceptions.QuallException):
@@ -28,109 +40,525 @@ class SeleniumDownloadException(SeleniumException):
   pass
 
 
+class WaitTimeoutException(SeleniumException):
+  """
+  Signifies that an explicit wait's conditions were not met by its deadline.
+  """
+
+  pass
+
+
 class WebDriverMixin(WebDriverAbstractions):
+  """This mixin provides Selenium WebDriver client functionality to any
+  derivative of quall.QuallBase.
+
+  The Selenium jar, the Selenium server and the WebDriver session are handed
+  out by the harness resource manager, so they are shared within the scopes
+  named by the C{selenium_scope} and C{driver_scope} configuration options.
+  If C{pool_size} is configured, sessions are instead checked out of a warm
+  L{WebDriverPool} and reset rather than quit when the driver is stopped.
+  """
 
   DEFAULT_COMMAND_EXECUTOR = "http://localhost"
   DEFAULT_DESIRED_CAPABILITIES = "CHROME"
   DEFAULT_DRIVER = "Chrome"
   DEFAULT_SELENIUM_URL = "http://selenium.googlecode.com/files/selenium-server-standalone-2.28.0.jar"
+  DEFAULT_SELENIUM_SCOPE = quall.resources.SESSION
+  DEFAULT_DRIVER_SCOPE = quall.resources.CLASS
+  DEFAULT_SELENIUM_STARTUP_TIMEOUT = 60
+  DEFAULT_SELENIUM_SHUTDOWN_GRACE = 5
+  DEFAULT_IMPLICIT_WAIT = 0
+  DEFAULT_WAIT_TIMEOUT = 30
+  INITIAL_WAIT_POLL_INTERVAL = 0.05
+  DEFAULT_MAX_WAIT_POLL_INTERVAL = 0.5
+  # Errors a wait poll can hit while the page changes under it; any other
+  # WebDriver error is a real failure and is not retried.
+  TRANSIENT_WAIT_EXCEPTIONS = (
+      selenium.common.exceptions.StaleElementReferenceException,)
+  DEFAULT_POOL_SCOPE = quall.resources.SESSION
+
+  # Lookup strategies from abstractions.parse_locator mapped to WebDriver's.
+  LOOKUP_STRATEGIES = {
+    "xpath": By.XPATH,
+    "css": By.CSS_SELECTOR,
+    "id": By.ID,
+    "name": By.NAME,
+    "link": By.LINK_TEXT,
+  }
+  # Strategies the batch resolution script can evaluate in the browser.
+  BATCHABLE_STRATEGIES = ("xpath", "css", "id", "name")
+  # Resolves many locators in a single round trip.  Takes a list of
+  # [strategy, value] pairs and a list of attribute names, and returns one
+  # result object (or an error message) per locator.  The "element" strategy
+  # describes an element already found by WebDriver (or null), so that every
+  # lookup strategy reports visibility and text with the same semantics.
+  BATCH_RESOLVE_SCRIPT = """
+    var queries = arguments[0], attributeNames = arguments[1], results = [];
+    function find(strategy, value) {
+      if (strategy == "element") { return value; }
+      if (strategy == "xpath") {
+        return document.evaluate(value, document, null,
+            XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+      }
+      if (strategy == "css") { return document.querySelector(value); }
+      if (strategy == "id") { return document.getElementById(value); }
+      return document.getElementsByName(value)[0] || null;
+    }
+    function isVisible(element) {
+      for (var node = element; node && node.nodeType == 1;
+          node = node.parentNode) {
+        var style = window.getComputedStyle(node, null);
+        if (style.display == "none" || style.visibility == "hidden") {
+          return false;
+        }
+      }
+      return element.offsetWidth > 0 || element.offsetHeight > 0 ||
+          element.getClientRects().length > 0;
+    }
+    for (var i = 0; i < queries.length; i++) {
+      try {
+        var element = find(queries[i][0], queries[i][1]);
+        var result = {present: element !== null, visible: false, text: null,
+            attributes: {}};
+        if (element !== null) {
+          result.visible = isVisible(element);
+          result.text = (element.innerText || element.textContent || "")
+              .replace(/^\\s+|\\s+$/g, "");
+          for (var j = 0; j < attributeNames.length; j++) {
+            result.attributes[attributeNames[j]] =
+                element.getAttribute(attributeNames[j]);
+          }
+        }
+        results.push(result);
+      } catch (e) {
+        results.push({error: String(e)});
+      }
+    }
+    return results;
+  """
+
+  # Reads the browser's navigation timing for the current page, in seconds
+  # relative to the start of navigation, or null if unavailable.
+  NAVIGATION_TIMING_SCRIPT = """
+    var timing = window.performance && window.performance.timing;
+    if (!timing || !timing.navigationStart) { return null; }
+    function since(end, start) {
+      return end > 0 && start > 0 ? (end - start) / 1000.0 : null;
+    }
+    return {
+      dns: since(timing.domainLookupEnd, timing.domainLookupStart),
+      connect: since(timing.connectEnd, timing.connectStart),
+      first_byte: since(timing.responseStart, timing.requestStart),
+      response: since(timing.responseEnd, timing.responseStart),
+      dom_interactive: since(timing.domInteractive, timing.navigationStart),
+      dom_content_loaded: since(timing.domContentLoadedEventEnd,
+          timing.navigationStart),
+      load: since(timing.loadEventEnd, timing.navigationStart)
+    };
+  """
+
+  DRIVER_RESOURCE_KEY = ("webdriver",)
+  POOL_RESOURCE_KEY = ("webdriver_pool",)
+
+  # Durations of every explicit wait in this process.
+  wait_statistics = WaitStatistics()
 
   def with_driver(fn):
-    def new_fn():
-      if self.driver == None:
+    def new_fn(self, *args, **kwargs):
+      if getattr(self, "driver", None) is None:
         self.start_driver()
-      fn()
+      return fn(self, *args, **kwargs)
     return new_fn
 
   def download_selenium(self):
-    self.temp_dir = tempfile.mkdtemp()
-    self.selenium_location = "%s/selenium.jar" % self.temp_dir
-    selenium_file = None
-    selenium_to_retrieve = None
+    selenium_url = self.config["webdriver"].get("selenium_jar_url",
+        self.DEFAULT_SELENIUM_URL)
     try:
-      selenium_file = open(self.selenium_location, "wb")
-      selenium_url = self.config["webdriver"].get("selenium_url",
-          DEFAULT_SELENIUM_URL)
-      self.log.info("Retrieving Selenium from %s" % selenium_url)
-      selenium_to_retrieve = urllib2.urlopen(selenium_url)
-      cur_chunk = selenium_to_retrieve.read(1024)
-      while cur_chunk != "":
-        selenium_file.write(cur_chunk)
-        cur_chunk = selenium_to_retrieve.read(1024)
+      self.selenium_location = self.get_artifact_cache().fetch(selenium_url,
+          checksum = self.config["webdriver"].get("selenium_jar_checksum"),
+          mirrors = self.config["webdriver"].get("selenium_jar_mirrors"))
+      return self.selenium_location
     except Exception:
       raise SeleniumDownloadException(
           "Failed to download Selenium:\n%s" % traceback.format_exc())
-    finally:
-      if selenium_file is not None:
-        selenium_file.close()
-      if selenium_to_retrieve is not None:
-        selenium_to_retrieve.close()
 
-  def start_selenium(self):
-    selenium_args = self.config["webdriver"].get("selenium_args", "")
-    self.selenium_port = int(self.config["webdriver"].get("selenium_port",
-        self.get_free_port()))
-    self.selenium_process = self.run_command(
-        "%s %s -port %s" % (self.selenium_process, selenium_args,
-            self.selenium_port), background = True)
+  def get_selenium_jar(self):
+    """
+    Obtains the location of the Selenium server jar, retrieving it through the
+    artifact cache at most once per process if configured to do so.
 
-  def start_driver(self):
-    # Downloads Selenium if configured to do so.
-    if self.config["webdriver"].get("download_selenium", False):
-      self.download_selenium()
-    else:
+    @return: the local path of the Selenium server jar
+    @rtype: str
+    """
+
+    if not self.config["webdriver"].get("download_selenium_jar", False):
       self.selenium_location = self.config["webdriver"]["selenium_location"]
-    # Starts Selenium if configured to do so.
-    if self.config["webdriver"].get("start_selenium", False):
-      self.start_selenium()
-    else:
-      self.selenium_process = None
+      return self.selenium_location
+    selenium_url = self.config["webdriver"].get("selenium_jar_url",
+        self.DEFAULT_SELENIUM_URL)
+    self.selenium_location = self.resources.acquire(quall.resources.PROCESS,
+        ("selenium_jar", selenium_url), self.download_selenium, retain = True)
+    return self.selenium_location
+
+  def start_selenium(self):
+    """
+    Starts a Selenium server, or attaches to one already started by another
+    worker process, and waits until it is ready to accept sessions.
+
+    @return: the running server
+    @rtype: L{SeleniumServer}
+    """
+
+    selenium_port = int(self.config["webdriver"].get("selenium_port") or
+        self.get_free_port())
+    self.selenium_server = SeleniumServer(self.selenium_location,
+        selenium_port,
+        args = self.config["webdriver"].get("selenium_args", ""),
+        java = self.config["webdriver"].get("java", "java"),
+        state_dir = self.config["webdriver"].get("selenium_state_dir"),
+        shared = self.config["webdriver"].get("selenium_shared", True))
+    self.selenium_server.start(
+        timeout = self.config["webdriver"].get("selenium_startup_timeout",
+            self.DEFAULT_SELENIUM_STARTUP_TIMEOUT))
+    return self.selenium_server
+
+  def stop_selenium(self, selenium_server):
+    selenium_server.stop(
+        grace_period = self.config["webdriver"].get("selenium_shutdown_grace",
+            self.DEFAULT_SELENIUM_SHUTDOWN_GRACE))
+
+  def create_driver(self):
+    """
+    Instantiates a new WebDriver session using the connection options defined
+    in the Quall configuration.
+
+    @return: a new WebDriver session
+    @rtype: selenium.webdriver.remote.webdriver.WebDriver
+    """
+
     # Obtains the requested driver and base desired driver capabilities.
     driver_class = getattr(selenium.webdriver,
         self.config["webdriver"].get("driver", self.DEFAULT_DRIVER))
-    desired_capabilities = getattr(
+    desired_capabilities = dict(getattr(
         selenium.webdriver.common.desired_capabilities.DesiredCapabilities,
         self.config["webdriver"].get("desired_capabilities_base",
-            self.DEFAULT_DESIRED_CAPABILITIES))
-    command_executor = self.config["webdriver"].get("command_executor",
-        self.DEFAULT_COMMAND_EXECUTOR)
-    self.log.info(
-        "Starting WebDriver with capabilities: %s" % desired_capabilities_base)
+            self.DEFAULT_DESIRED_CAPABILITIES)))
     # Overrides base driver capabilities with those specified in configuration.
     if self.config["webdriver"].has_key("desired_capabilities"):
       for key in self.config["webdriver"]["desired_capabilities"].keys():
         capability = self.config["webdriver"]["desired_capabilities"][key]
         desired_capabilities[key] = capability
+    # Passes only the arguments the driver accepts: local drivers take no
+    # command executor, and Firefox names its capabilities differently.
+    driver_arguments = inspect.getargspec(driver_class.__init__).args
+    driver_kwargs = {}
+    if "desired_capabilities" in driver_arguments:
+      driver_kwargs["desired_capabilities"] = desired_capabilities
+    elif "capabilities" in driver_arguments:
+      driver_kwargs["capabilities"] = desired_capabilities
+    if "command_executor" in driver_arguments:
+      command_executor = self.config["webdriver"].get("command_executor")
+      if command_executor is None:
+        if getattr(self, "selenium_server", None) is not None:
+          command_executor = self.selenium_server.get_url()
+        else:
+          command_executor = self.DEFAULT_COMMAND_EXECUTOR
+      driver_kwargs["command_executor"] = command_executor
+    self.log.info(
+        "Starting WebDriver with capabilities: %s" % desired_capabilities)
     # Instantiates WebDriver client connection.
-    self.driver = driver_class(
-        desired_capabilities = desired_capabilities,
-        command_executor = command_executor)
-    self.driver.implicitly_wait(30)
+    driver = driver_class(**driver_kwargs)
+    driver.implicitly_wait(self.config["webdriver"].get("implicit_wait",
+        self.DEFAULT_IMPLICIT_WAIT))
+    if quall.metrics.registry.enabled:
+      self._instrument_driver(driver)
     self.log.info("WebDriver successfully started.")
+    return driver
+
+  def create_driver_pool(self):
+    pool = WebDriverPool(self.create_driver,
+        size = int(self.config["webdriver"]["pool_size"]),
+        max_uses = self.config["webdriver"].get("pool_max_uses"))
+    if self.config["webdriver"].get("pool_warm", True):
+      pool.warm()
+    return pool
+
+  def get_driver_pool(self):
+    """
+    Obtains the WebDriver session pool shared within the C{pool_scope}, creating
+    and warming it on first use.
+
+    @return: the shared session pool, or None if pooling is not configured
+    @rtype: L{WebDriverPool}
+    """
 
-  def stop_driver(self):
-    # Ends the WebDriver session.
-    if "driver" in dir(self):
-      if self.driver is not None:
-        self.log.info("Ending WebDriver session...")
-        driver.quit()
-    # If Selenium process is active, terminates it.
-    if "selenium_process" in dir(self):
-      if self.selenium_process is not None:
-        self.log.info("Terminating Selenium process...")
-        self.selenium_process.terminate()
-        self.sleep(30)
-        if not self.selenium_process.poll():
-          self.log.info("Killing Selenium process...")
-          self.selenium_process.kill()
+    if not self.config["webdriver"].get("pool_size"):
+      return None
+    return self.resources.acquire(
+        self.config["webdriver"].get("pool_scope", self.DEFAULT_POOL_SCOPE),
+        self.POOL_RESOURCE_KEY, self.create_driver_pool,
+        finalizer = lambda pool: pool.close(), retain = True)
+
+  def _instrument_driver(self, driver):
+    # Times every WebDriver wire protocol command sent through this session.
+    execute = driver.execute
+    def timed_execute(driver_command, params = None):
+      with quall.metrics.registry.timer("quall_webdriver_command_seconds",
+          command = driver_command):
+        return execute(driver_command, params)
+    driver.execute = timed_execute
+
+  def start_driver(self):
+    # Starts Selenium if configured to do so, sharing one server per scope.
+    if self.config["webdriver"].get("start_selenium", False):
+      self.get_selenium_jar()
+      self.selenium_server = self.resources.acquire(
+          self.config["webdriver"].get("selenium_scope",
+              self.DEFAULT_SELENIUM_SCOPE),
+          ("selenium", self.selenium_location), self.start_selenium,
+          finalizer = self.stop_selenium, retain = True)
+    else:
+      self.selenium_server = None
+    # Checks a warm WebDriver session out of the pool if one is configured.
+    self.driver_pool = self.get_driver_pool()
+    if self.driver_pool is not None:
+      self.driver = self.driver_pool.acquire()
+      return
+    # Otherwise, obtains a WebDriver session.  Class-scoped sessions are quit
+    # once released; longer-lived ones are shared until their scope ends.
+    driver_scope = self.config["webdriver"].get("driver_scope",
+        self.DEFAULT_DRIVER_SCOPE)
+    self.driver = self.resources.acquire(driver_scope,
+        self.DRIVER_RESOURCE_KEY, self.create_driver,
+        finalizer = lambda driver: driver.quit(),
+        retain = driver_scope != quall.resources.CLASS)
+
+  def stop_driver(self, broken = False):
+    """
+    Releases this instance's WebDriver session and Selenium server.  A
+    class-scoped session is quit once its last holder releases it; longer-lived
+    sessions and the server are torn down when their scope ends, and pooled
+    sessions are reset and returned to the pool instead.
+
+    @param broken: whether the WebDriver session is known to have crashed, in
+        which case it is recycled (if pooled) or quit at once rather than
+        reused
+    @type broken: boolean
+    """
+
+    if getattr(self, "driver", None) is not None:
+      if getattr(self, "driver_pool", None) is not None:
+        self.log.info("Returning WebDriver session to pool...")
+        self.driver_pool.release(self.driver, broken = broken)
+        self.resources.release(self.POOL_RESOURCE_KEY)
+        self.driver_pool = None
+      elif broken:
+        self.log.info("Discarding broken WebDriver session...")
+        self.resources.discard(self.DRIVER_RESOURCE_KEY)
+      else:
+        self.log.info("Releasing WebDriver session...")
+        self.resources.release(self.DRIVER_RESOURCE_KEY)
+      self.driver = None
+    if getattr(self, "selenium_server", None) is not None:
+      self.log.info("Releasing Selenium server...")
+      self.resources.release(("selenium", self.selenium_location))
+      self.selenium_server = None
 
   def webdriver_cleanup(self):
     self.stop_driver()
-    if "temp_dir" in dir(self):
-      self.log.debug("Removing temp dir: %s" % self.temp_dir)
-      shutil.rmtree(self.temp_dir)
+    self.log_wait_statistics()
+
+  def record_navigation_timing(self, host = ""):
+    """
+    Records the browser's navigation timing for the current page into the
+    metrics registry, one histogram sample per navigation phase.
+
+    @param host: the host label to record the samples under; empty for pages
+        without a host (optional)
+    @type host: str
+    """
+
+    timing = self.driver.execute_script(self.NAVIGATION_TIMING_SCRIPT)
+    if not timing:
+      return
+    for (phase, seconds) in timing.items():
+      if seconds is not None:
+        quall.metrics.registry.observe("quall_browser_navigation_seconds",
+            seconds, host = host, phase = phase)
 
   @with_driver
   def go(self, url):
     self.log.info("Opening URL: %s" % url)
-    self.driver.get(url)
+    # about:blank, file: and data: URLs have no host.
+    host = urlparse.urlparse(url).hostname or ""
+    with quall.metrics.registry.timer("quall_webdriver_go_seconds",
+        host = host):
+      self.driver.get(url)
+    if quall.metrics.registry.enabled:
+      self.record_navigation_timing(host)
+
+  @with_driver
+  def find_elements(self, element):
+    """
+    Looks up every match for an element using its compiled lookup strategy:
+    a CSS selector for templates comparing a raw attribute, and otherwise the
+    strategy of the rendered locator itself.
+
+    @param element: the element to look up
+    @type element: L{Element}
+
+    @return: the matching WebDriver elements
+    @rtype: list
+    """
+
+    (strategy, value) = element.get_query()
+    return self.driver.find_elements(by = self.LOOKUP_STRATEGIES[strategy],
+        value = value)
+
+  def _find_for_batch(self, element):
+    # Finds an element WebDriver-side, as a query the batch script describes.
+    found = self.find_elements(element)
+    return ["element", found[0] if found else None]
+
+  def _resolve_element(self, element, attributes):
+    # Resolves a single element through WebDriver's own lookup.
+    return self.driver.execute_script(self.BATCH_RESOLVE_SCRIPT,
+        [self._find_for_batch(element)], attributes)[0]
+
+  @with_driver
+  def resolve_elements(self, elements, attributes = ()):
+    """
+    Looks up many elements at once, evaluating every batchable locator in a
+    single C{execute_script} round trip.  Locators that cannot be evaluated in
+    the browser, such as C{link=}, are looked up individually first and then
+    described in the same round trip.
+
+    Visibility and text are always computed by L{BATCH_RESOLVE_SCRIPT}
+    whatever the lookup strategy: an element is visible if neither it nor an
+    ancestor has C{display: none} or C{visibility: hidden} and it has a
+    layout box, and its text is its trimmed C{innerText} (or
+    C{textContent}).  These approximate, but are not identical to,
+    C{is_displayed()} and C{.text}.
+
+    @param elements: the elements to resolve
+    @type elements: list of L{Element}
+    @param attributes: names of attributes to read from each present element
+    @type attributes: list of str
+
+    @return: one dict per element, in order, with keys C{present},
+        C{visible}, C{text} and C{attributes}
+    @rtype: list
+    """
+
+    attributes = list(attributes)
+    if not elements:
+      return []
+    queries = []
+    for element in elements:
+      query = element.get_query()
+      if query[0] in self.BATCHABLE_STRATEGIES:
+        queries.append(list(query))
+      else:
+        queries.append(self._find_for_batch(element))
+    self.log.debug("Resolving %s element(s) in one round trip" % len(queries))
+    results = self.driver.execute_script(self.BATCH_RESOLVE_SCRIPT, queries,
+        attributes)
+    for (index, element) in enumerate(elements):
+      if "error" in results[index]:
+        # Lets WebDriver perform the lookup, and report why it fails.
+        self.log.debug("Batch lookup of %s failed: %s" % (element,
+            results[index]["error"]))
+        results[index] = self._resolve_element(element, attributes)
+    return results
+
+  def wait_for(self, conditions, timeout = None, require_all = True,
+      description = None):
+    """
+    Polls until the supplied conditions are met, evaluating all of them with a
+    single round trip per poll.  The poll interval starts short and backs off
+    while nothing changes, and is reset whenever a condition changes state.
+    A poll that fails because an element went stale during a page transition
+    counts as unmet and polling continues; any other error propagates.
+
+    @param conditions: the conditions to wait on, e.g. C{Visible(element)}
+    @type conditions: list of L{quall.mixins.webdriver.waits.Condition}
+    @param timeout: seconds to wait; defaults to the C{wait_timeout} option
+    @type timeout: float
+    @param require_all: whether every condition must be met, rather than any
+    @type require_all: boolean
+    @param description: the name to record this wait's duration under
+    @type description: str
+
+    @return: the final element state of each condition, in order
+    @rtype: list
+
+    @raise WaitTimeoutException: if the conditions are not met in time
+    """
+
+    if timeout is None:
+      timeout = self.config["webdriver"].get("wait_timeout",
+          self.DEFAULT_WAIT_TIMEOUT)
+    max_interval = self.config["webdriver"].get("wait_max_poll_interval",
+        self.DEFAULT_MAX_WAIT_POLL_INTERVAL)
+    if description is None:
+      description = "; ".join(str(condition) for condition in conditions)
+    start = time.time()
+    deadline = start + timeout
+    interval = self.INITIAL_WAIT_POLL_INTERVAL
+    polls = 0
+    last_met = None
+    while True:
+      error = None
+      try:
+        states = self.resolve_elements(
+            [condition.element for condition in conditions])
+        met = [condition.is_met(state)
+            for (condition, state) in zip(conditions, states)]
+      except self.TRANSIENT_WAIT_EXCEPTIONS as e:
+        self.log.debug("Wait poll failed: %s" % e)
+        error = e
+        met = [False] * len(conditions)
+      polls += 1
+      if (require_all and all(met)) or (not require_all and any(met)):
+        self.wait_statistics.record(description, time.time() - start, polls,
+            True)
+        return states
+      now = time.time()
+      if now >= deadline:
+        self.wait_statistics.record(description, now - start, polls, False)
+        message = "Timed out after %s seconds waiting for: %s" % (timeout,
+            "; ".join(str(condition) for (condition, is_met)
+                in zip(conditions, met) if not is_met))
+        if error is not None:
+          message += " (last poll failed: %s)" % error
+        raise WaitTimeoutException(message)
+      if met != last_met:
+        interval = self.INITIAL_WAIT_POLL_INTERVAL
+      last_met = met
+      time.sleep(min(interval, deadline - now))
+      interval = min(interval * 1.5, max_interval)
+
+  def wait_for_present(self, element, timeout = None):
+    return self.wait_for([Present(element)], timeout)[0]
+
+  def wait_for_visible(self, element, timeout = None):
+    return self.wait_for([Visible(element)], timeout)[0]
+
+  def wait_for_gone(self, element, timeout = None):
+    return self.wait_for([Gone(element)], timeout)[0]
+
+  def wait_for_text(self, element, pattern, timeout = None):
+    return self.wait_for([TextMatches(element, pattern)], timeout)[0]
+
+  def log_wait_statistics(self):
+    """
+    Logs the count, timeouts, mean and maximum duration of every explicit wait
+    recorded in this process, slowest first.
+    """
+
+    summary = self.wait_statistics.summary()
+    for description in sorted(summary, key = lambda d: -summary[d]["max"]):
+      stats = summary[description]
+      self.log.info("Wait %s: count=%s timeouts=%s mean=%.3fs max=%.3fs "
+          "polls=%s" % (description, stats["count"], stats["timeouts"],
+              stats["mean"], stats["max"], stats["polls"]))
@@ -1,112 +1,326 @@
 # -*- coding: utf-8 -*-
 """
-    quall.mixins.selenium.abstractions
-    ~~~~~~~~~~~~~~~~~~~~~
+    quall.mixins.webdriver.abstractions
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
-    Provides Selenium client functionality.
+    Provides page-object abstractions for locating elements with WebDriver.
+
+    Locator templates are compiled once, when they are defined, into literal
+    fragments and argument slots; malformed placeholders are rejected at that
+    point.  Rendered locators are memoized per argument text, and elements
+    cache their rendered locator, so large page-object libraries stay cheap to
+    build and resolve.
+
+    Templates which only compare a raw attribute against their argument, such
+    as C{BasicStrategies.button}, are also compiled to a CSS attribute
+    selector, which browsers answer natively.  Templates that
+    whitespace-normalize the attribute keep their XPath, since no native
+    lookup normalizes, as do the row and checkbox constructs.
 
     Example::
-      
+      search_box = Element("q", strategy = BasicStrategies.name)
+      search_box.get_locator()    # "//*[normalize-space(@name)='q']"
 """
 
-class WebDriverAbstractions(object):
 
-  class Element(object):
-    locator = None
-    humanReadable = None
-    strategy = None
-
-    def __init__(self, *args, **kwargs):
-      if "locator" in kwargs:
-        self.locator = kwargs['locator']
-      if "humanReadable" in kwargs:
-        self.humanReadable = kwargs['humanReadable']
-      if "strategy" in kwargs:
-        self.strategy = kwargs['strategy']
-      self.args = args
-        
-    def __str__(self):
-      if len(self.get_human_readable()) > 0:
-        return "locator: %s (%s)" % (self.get_locator(), self.get_human_readable())
-      return "locator: %s" % self.get_locator()
-        
-    def get_locator(self):
-      if self.strategy is not None:
-        return self.strategy.get_locator(self.args)
-      return self.locator
-        
-    def get_human_readable(self):
+import re
+
+import quall.exceptions
+
+
+class LocatorTemplateException(quall.exceptions.QuallException):
+  """
+  Signifies that a locator template is malformed or was rendered with the
+  wrong number of arguments.
+  """
+
+  pass
+
+
+# Matches every "%" directive so that anything other than "%(N)s" or "%%" can
+# be rejected, along with "$(N)s", a common typo for "%(N)s".
+_DIRECTIVE_PATTERN = re.compile(r"%\((\d+)\)s|%%|%|\$\((\d+)\)s")
+
+
+def _compile_template(template):
+  """
+  Splits a template into alternating literal fragments and argument indexes.
+
+  @return: (parts, arity) where parts is a tuple of str literals and int
+      argument indexes
+  @rtype: tuple
+  """
+
+  parts = []
+  literal = []
+  arity = 0
+  position = 0
+  for match in _DIRECTIVE_PATTERN.finditer(template):
+    literal.append(template[position:match.start()])
+    position = match.end()
+    if match.group(1) is not None:
+      index = int(match.group(1))
+      parts.append("".join(literal))
+      parts.append(index)
+      literal = []
+      arity = max(arity, index + 1)
+    elif match.group(0) == "%%":
+      literal.append("%")
+    elif match.group(2) is not None:
+      raise LocatorTemplateException(
+          "Malformed placeholder %s in locator template %r; did you mean "
+          "%%(%s)s?" % (match.group(0), template, match.group(2)))
+    else:
+      raise LocatorTemplateException(
+          "Unsupported %% directive at offset %s in locator template %r" % (
+              match.start(), template))
+  literal.append(template[position:])
+  parts.append("".join(literal))
+  return (tuple(part for part in parts if part != ""), arity)
+
+
+# XPath templates that can be answered by a CSS attribute selector: a raw
+# attribute compared against the sole argument.
+_NATIVE_TEMPLATE_PATTERN = re.compile(r"^//\*\[@([\w-]+)='%\(0\)s'\]$")
+
+
+def _compile_native(template):
+  """
+  @return: the attribute to select on with CSS, or None if the template must
+      be answered by its XPath
+  @rtype: str
+  """
+
+  match = _NATIVE_TEMPLATE_PATTERN.match(template)
+  if match is None:
+    return None
+  return match.group(1)
+
+
+def _css_string(value):
+  return '"%s"' % value.replace("\\", "\\\\").replace('"', '\\"').replace(
+      "\n", "\\a ")
+
+
+def _render(parts, args):
+  return "".join(
+      args[part] if part.__class__ is int else part for part in parts)
+
+
+# Locator prefixes understood by parse_locator, mapped to lookup strategies.
+_LOCATOR_PREFIXES = {
+  "xpath": "xpath",
+  "css": "css",
+  "id": "id",
+  "name": "name",
+  "link": "link",
+}
+
+
+def parse_locator(locator):
+  """
+  Splits a rendered locator into its lookup strategy and value.  Locators
+  beginning with C{/} or C{(} are XPath; others may carry an explicit
+  C{strategy=} prefix and otherwise default to element IDs.
+
+  @param locator: a rendered locator such as C{"link=Home"} or C{"//a"}
+  @type locator: str
+
+  @return: (strategy, value) where strategy is one of xpath, css, id, name or
+      link
+  @rtype: tuple
+  """
+
+  if locator.startswith("/") or locator.startswith("("):
+    return ("xpath", locator)
+  (prefix, separator, value) = locator.partition("=")
+  if separator and prefix in _LOCATOR_PREFIXES:
+    return (_LOCATOR_PREFIXES[prefix], value)
+  return ("id", locator)
+
+
+def _as_text(arg):
+  if isinstance(arg, basestring):
+    return arg
+  return str(arg)
+
+
+class LocatorStrategy(object):
+  __slots__ = ()
+
+  def get_locator(self, args):
+    raise NotImplementedError
+
+  def get_template(self):
+    raise NotImplementedError
+
+  def get_human_readable(self, args):
+    raise NotImplementedError
+
+
+class LocatorTemplate(LocatorStrategy):
+  """A locator strategy rendered from a C{%(N)s}-style template.
+  """
+
+  __slots__ = ("humanReadable", "template", "arity", "native",
+      "_locator_parts", "_readable_parts", "_cache")
+
+  # Bounds the memo of rendered locators for templates fed unique arguments.
+  MAX_CACHE_SIZE = 4096
+
+  def __init__(self, name, template):
+    self.humanReadable = name
+    self.template = template
+    (self._locator_parts, locator_arity) = _compile_template(template)
+    (self._readable_parts, readable_arity) = _compile_template(name)
+    self.arity = max(locator_arity, readable_arity)
+    self.native = _compile_native(template)
+    self._cache = {}
+
+  def _query(self, locator, args):
+    if self.native is not None:
+      return ("css", "*[%s=%s]" % (self.native, _css_string(args[0])))
+    return parse_locator(locator)
+
+  def _render_all(self, args):
+    # Keyed on the text of the arguments: 1, 1.0 and True hash equal but
+    # render differently.
+    text_args = tuple(_as_text(arg) for arg in args)
+    try:
+      return self._cache[text_args]
+    except KeyError:
+      pass
+    if len(args) < self.arity:
+      raise LocatorTemplateException(
+          "Locator template %r expects %s argument(s), got %s" % (
+              self.template, self.arity, len(args)))
+    locator = _render(self._locator_parts, text_args)
+    rendered = (locator, _render(self._readable_parts, text_args),
+        self._query(locator, text_args))
+    if len(self._cache) >= self.MAX_CACHE_SIZE:
+      self._cache.clear()
+    self._cache[text_args] = rendered
+    return rendered
+
+  def get_locator(self, args):
+    return self._render_all(tuple(args))[0]
+
+  def get_template(self):
+    return self.template
+
+  def get_human_readable(self, args):
+    return self._render_all(tuple(args))[1]
+
+  def get_query(self, args):
+    """
+    @return: the fastest (strategy, value) pair to look the rendered locator
+        up with
+    @rtype: tuple
+    """
+
+    return self._render_all(tuple(args))[2]
+
+
+class Element(object):
+  """A locatable page element, described either by a literal locator or by a
+  strategy and the arguments to render it with.
+  """
+
+  __slots__ = ("locator", "humanReadable", "strategy", "args", "_rendered",
+      "_query")
+
+  def __init__(self, *args, **kwargs):
+    self.locator = kwargs.get("locator")
+    self.humanReadable = kwargs.get("humanReadable")
+    self.strategy = kwargs.get("strategy")
+    self.args = args
+    self._rendered = None
+    self._query = None
+    arity = getattr(self.strategy, "arity", None)
+    if arity is not None and len(args) < arity:
+      raise LocatorTemplateException(
+          "Locator template %r expects %s argument(s), got %s" % (
+              self.strategy.get_template(), arity, len(args)))
+
+  def _render(self):
+    if self._rendered is None:
       if self.strategy is not None:
-        return self.strategy.get_human_readable(self.args)
-      return self.humanReadable
-
-  class LocatorStrategy(object):
-    def get_human_readable(self):
-      raise NotImplementedError
-        
-    def get_locator(self, *args):
-      raise NotImplementedError
-        
-    def get_template(self):
-      raise NotImplementedError
-        
-    def get_human_readable(self, *args):
-      raise NotImplementedError
-
-  class LocatorTemplate(LocatorStrategy):
-    def __init__(self, name, template):
-      self.humanReadable = name
-      self.template = template
-        
-    def get_locator(self, args):
-      repl_dict = dict()
-      for i in xrange(0, len(args)):
-        repl_dict[str(i)] = args[i]
-      return self.template % repl_dict
-        
-    def get_template(self):
-      return self.template
-        
-    def get_human_readable(self, args):
-      repl_dict = dict()
-      for i in xrange(0, len(args)):
-        repl_dict[str(i)] = args[i]
-      return self.humanReadable % repl_dict
-        
-  class BasicStrategies(object):
-    # Basic page constructs:
-    id = LocatorTemplate("element with id=%(0)s",
-        "//*[normalize-space(@id)='%(0)s']")
-    link = LocatorTemplate("link=%(0)s", "link=%(0)s")
-    alt = LocatorTemplate("alt=$(0)s",
-        "//*[normalize-space(@alt)='$(0)s']")
-    name = LocatorTemplate("name=%(0)s",
-        "//*[normalize-space(@name)='%(0)s']")
-    title = LocatorTemplate("title=%(0)s", 
-        "//*[normalize-space(@title)='%(0)s']")
-    css_class = LocatorTemplate("class=%(0)s", 
-        "//*[normalize-space(@class)='%(0)s']")
-    button = LocatorTemplate("button=%(0)s", 
-        "//*[@value='%(0)s']")
-
-    # Row constructs:
-    row_with_two_elements = LocatorTemplate(
-        "table row containing '%(0)s' and '%(1)s'",
-        "//*[self::tr]/*[self::td and (normalize-space(.)='%(0)s' or "
-        "normalize-space(.)='%(0)s *' or contains(.,'%(0)s'))]/../*[self::td "
-        "and (normalize-space(.)='%(1)s' or normalize-space(.)='%(1)s *' or "
-        "contains(.,'%(1)s'))]/..")
-
-    # Common page patterns:
-    checkbox_next_to_text = LocatorTemplate("checkbox next to text=%(0)s",
-        "//*[(self::td or contains(@class,'dr-table-cell')) and "
-        "normalize-space(.)='%(0)s']/..//*[@type='checkbox']")
-        
-  class BasicElements(object):
-    bookmarked_element = Element("quallBookmark", strategy = BasicStrategies.id)
-
-    # Some garden-variety button types:
-    ok_button = Element("OK", strategy = BasicStrategies.button)
-    clear_button = Element("Clear", strategy = BasicStrategies.button)
-    cancel_button = Element("Cancel", strategy = BasicStrategies.button)
-    submit_button = Element("Submit", strategy = BasicStrategies.button)
+        self._rendered = (self.strategy.get_locator(self.args),
+            self.strategy.get_human_readable(self.args))
+      else:
+        self._rendered = (self.locator, self.humanReadable)
+    return self._rendered
+
+  def __str__(self):
+    (locator, human_readable) = self._render()
+    if human_readable:
+      return "locator: %s (%s)" % (locator, human_readable)
+    return "locator: %s" % locator
+
+  def get_locator(self):
+    return self._render()[0]
+
+  def get_human_readable(self):
+    return self._render()[1]
+
+  def get_query(self):
+    """
+    @return: the (strategy, value) pair to look this element up with
+    @rtype: tuple
+    """
+
+    if self._query is None:
+      if isinstance(self.strategy, LocatorTemplate):
+        self._query = self.strategy.get_query(self.args)
+      else:
+        self._query = parse_locator(self.get_locator())
+    return self._query
+
+
+class BasicStrategies(object):
+  # Basic page constructs:
+  id = LocatorTemplate("element with id=%(0)s",
+      "//*[normalize-space(@id)='%(0)s']")
+  link = LocatorTemplate("link=%(0)s", "link=%(0)s")
+  alt = LocatorTemplate("alt=%(0)s",
+      "//*[normalize-space(@alt)='%(0)s']")
+  name = LocatorTemplate("name=%(0)s",
+      "//*[normalize-space(@name)='%(0)s']")
+  title = LocatorTemplate("title=%(0)s",
+      "//*[normalize-space(@title)='%(0)s']")
+  css_class = LocatorTemplate("class=%(0)s",
+      "//*[normalize-space(@class)='%(0)s']")
+  button = LocatorTemplate("button=%(0)s",
+      "//*[@value='%(0)s']")
+
+  # Row constructs:
+  row_with_two_elements = LocatorTemplate(
+      "table row containing '%(0)s' and '%(1)s'",
+      "//*[self::tr]/*[self::td and (normalize-space(.)='%(0)s' or "
+      "normalize-space(.)='%(0)s *' or contains(.,'%(0)s'))]/../*[self::td "
+      "and (normalize-space(.)='%(1)s' or normalize-space(.)='%(1)s *' or "
+      "contains(.,'%(1)s'))]/..")
+
+  # Common page patterns:
+  checkbox_next_to_text = LocatorTemplate("checkbox next to text=%(0)s",
+      "//*[(self::td or contains(@class,'dr-table-cell')) and "
+      "normalize-space(.)='%(0)s']/..//*[@type='checkbox']")
+
+
+class BasicElements(object):
+  bookmarked_element = Element("quallBookmark", strategy = BasicStrategies.id)
+
+  # Some garden-variety button types:
+  ok_button = Element("OK", strategy = BasicStrategies.button)
+  clear_button = Element("Clear", strategy = BasicStrategies.button)
+  cancel_button = Element("Cancel", strategy = BasicStrategies.button)
+  submit_button = Element("Submit", strategy = BasicStrategies.button)
+
+
+class WebDriverAbstractions(object):
+
+  Element = Element
+  LocatorStrategy = LocatorStrategy
+  LocatorTemplate = LocatorTemplate
+  BasicStrategies = BasicStrategies
+  BasicElements = BasicElements
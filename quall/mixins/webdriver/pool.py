@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+"""
+    quall.mixins.webdriver.pool
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Provides a pool of pre-launched WebDriver sessions.
+
+    Sessions are reset rather than quit when returned to the pool, and are
+    recycled after a configurable number of uses or as soon as they fail a
+    health check.
+
+    Example::
+      pool = WebDriverPool(self.create_driver, size = 4, max_uses = 50)
+      pool.warm()
+      driver = pool.acquire()
+      ...
+      pool.release(driver)
+"""
+
+
+import logging
+import threading
+import time
+import traceback
+
+import quall.exceptions
+
+
+class WebDriverPoolException(quall.exceptions.QuallException):
+  """
+  Base class for all WebDriver pool exceptions.
+  """
+
+  pass
+
+
+class WebDriverPoolTimeoutException(WebDriverPoolException):
+  """
+  Signifies that no WebDriver session became available in time.
+  """
+
+  pass
+
+
+class _PooledSession(object):
+  """
+  Book-keeping record for a single pooled WebDriver session.
+  """
+
+  def __init__(self, driver):
+    self.driver = driver
+    self.uses = 0
+
+
+class WebDriverPool(object):
+  """Keeps up to C{size} WebDriver sessions alive and hands them out on
+  demand.  Works with any driver the supplied factory creates, local or
+  C{Remote}.
+  """
+
+  RESET_URL = "about:blank"
+  # Clears web storage for the current origin; storage is unavailable on
+  # about:blank, so this has to run before navigating away.
+  RESET_SCRIPT = (
+      "try { window.localStorage.clear(); } catch (e) {}"
+      "try { window.sessionStorage.clear(); } catch (e) {}")
+
+  log = logging.getLogger("quall.webdriver.pool")
+
+  def __init__(self, factory, size = 1, max_uses = None):
+    """
+    @param factory: a callable taking no arguments which starts a new session
+    @type factory: callable
+    @param size: the maximum number of live sessions
+    @type size: int
+    @param max_uses: the number of uses after which a session is recycled, or
+        None to reuse sessions indefinitely
+    @type max_uses: int
+    """
+
+    self.factory = factory
+    self.size = max(int(size), 1)
+    self.max_uses = max_uses
+    self._condition = threading.Condition()
+    self._idle = []
+    self._in_use = {}
+    self._pending = 0
+    self._closed = False
+
+  def _live_count(self):
+    return len(self._idle) + len(self._in_use) + self._pending
+
+  def _add_idle_session(self):
+    # The caller is expected to have reserved a pending slot.
+    session = None
+    try:
+      session = _PooledSession(self.factory())
+    except Exception:
+      self.log.warning(
+          "Failed to start pooled WebDriver session:\n%s" %
+              traceback.format_exc())
+    with self._condition:
+      self._pending -= 1
+      if session is None:
+        self._condition.notify()
+        return
+      if self._closed:
+        self._quit(session)
+        return
+      self._idle.append(session)
+      self._condition.notify()
+
+  def _quit(self, session):
+    try:
+      session.driver.quit()
+    except Exception:
+      self.log.debug(
+          "Failed to quit WebDriver session:\n%s" % traceback.format_exc())
+
+  def _is_healthy(self, session):
+    try:
+      session.driver.current_url
+      return True
+    except Exception:
+      self.log.info("Pooled WebDriver session failed health check")
+      return False
+
+  def _reset(self, session):
+    driver = session.driver
+    # Closes any windows the test left behind.
+    handles = driver.window_handles
+    for handle in handles[1:]:
+      driver.switch_to_window(handle)
+      driver.close()
+    driver.switch_to_window(handles[0])
+    driver.delete_all_cookies()
+    driver.execute_script(self.RESET_SCRIPT)
+    driver.get(self.RESET_URL)
+
+  def _replenish(self):
+    # Starts a replacement session in the background to keep the pool warm.
+    with self._condition:
+      if self._closed or self._live_count() >= self.size:
+        return
+      self._pending += 1
+    thread = threading.Thread(target = self._add_idle_session)
+    thread.daemon = True
+    thread.start()
+
+  def warm(self):
+    """
+    Starts sessions in parallel until the pool holds C{size} live sessions.
+    """
+
+    with self._condition:
+      missing = self.size - self._live_count()
+      self._pending += max(missing, 0)
+    self.log.info("Warming WebDriver pool with %s session(s)" % missing)
+    threads = [threading.Thread(target = self._add_idle_session)
+        for i in xrange(max(missing, 0))]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+
+  def acquire(self, timeout = None):
+    """
+    Checks a ready WebDriver session out of the pool, starting one if the pool
+    is not yet full.
+
+    @param timeout: seconds to wait for a session to become free (optional)
+    @type timeout: float
+
+    @return: a ready WebDriver session
+    @rtype: selenium.webdriver.remote.webdriver.WebDriver
+
+    @raise WebDriverPoolTimeoutException: if no session becomes free in time
+    @raise WebDriverPoolException: if the pool is closed
+    """
+
+    deadline = None
+    if timeout is not None:
+      deadline = time.time() + timeout
+    while True:
+      with self._condition:
+        while not (self._closed or self._idle or
+            self._live_count() < self.size):
+          remaining = None
+          if deadline is not None:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+              raise WebDriverPoolTimeoutException(
+                  "No WebDriver session became free within %s seconds" %
+                      timeout)
+          self._condition.wait(remaining)
+        if self._closed:
+          raise WebDriverPoolException("The WebDriver pool is closed")
+        session = None
+        if self._idle:
+          session = self._idle.pop()
+        else:
+          # Reserves a slot for the session about to be started.
+          self._pending += 1
+      if session is None:
+        try:
+          session = _PooledSession(self.factory())
+        finally:
+          with self._condition:
+            self._pending -= 1
+            self._condition.notify()
+      elif not self._is_healthy(session):
+        self._quit(session)
+        self._replenish()
+        continue
+      with self._condition:
+        closed = self._closed
+        if not closed:
+          self._in_use[id(session.driver)] = session
+      if closed:
+        # The pool was closed while the session was being started or checked.
+        self._quit(session)
+        raise WebDriverPoolException("The WebDriver pool is closed")
+      return session.driver
+
+  def release(self, driver, broken = False):
+    """
+    Returns a WebDriver session to the pool, resetting it for the next test or
+    recycling it if it is broken or has reached its use limit.
+
+    @param driver: a session previously obtained from L{acquire}
+    @type driver: selenium.webdriver.remote.webdriver.WebDriver
+    @param broken: whether the caller knows the session to be unusable
+    @type broken: boolean
+    """
+
+    with self._condition:
+      session = self._in_use.pop(id(driver), None)
+    if session is None:
+      self.log.warning("Released a WebDriver session not owned by the pool")
+      return
+    session.uses += 1
+    recycle = broken or self._closed
+    if self.max_uses is not None and session.uses >= self.max_uses:
+      self.log.debug("Recycling WebDriver session after %s uses" % session.uses)
+      recycle = True
+    if not recycle:
+      try:
+        self._reset(session)
+      except Exception:
+        self.log.info(
+            "Failed to reset WebDriver session:\n%s" % traceback.format_exc())
+        recycle = True
+    if recycle:
+      self._quit(session)
+      with self._condition:
+        self._condition.notify()
+      self._replenish()
+      return
+    with self._condition:
+      self._idle.append(session)
+      self._condition.notify()
+
+  def close(self):
+    """
+    Quits every session owned by the pool.
+    """
+
+    with self._condition:
+      self._closed = True
+      sessions = self._idle + self._in_use.values()
+      self._idle = []
+      self._in_use = {}
+      self._condition.notify_all()
+    for session in sessions:
+      self._quit(session)
@@ -0,0 +1,367 @@
+# -*- coding: utf-8 -*-
+"""
+    quall.mixins.webdriver.server
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Provides lifecycle management for a local Selenium server.
+
+    The server is started in its own process group, probed until its status
+    endpoint answers, and stopped with a short grace period before the whole
+    group is killed.  Servers are registered in a state file so that other
+    worker processes using the same jar and arguments attach to the running
+    server instead of starting their own; the last process to detach stops it.
+    Processes are recorded by PID and start time, so a stale state file whose
+    PID has been reused by an unrelated process is never attached to or
+    signalled.
+
+    Example::
+      server = SeleniumServer("/path/to/selenium.jar", 4444, "-timeout 120")
+      server.start()
+      driver = webdriver.Remote(command_executor = server.get_url(), ...)
+      ...
+      server.stop()
+"""
+
+
+import errno
+import hashlib
+import json
+import logging
+import os
+import signal
+import subprocess
+import tempfile
+import time
+import urllib2
+
+import quall.exceptions
+from quall.cache import FileLock
+
+
+class SeleniumServerException(quall.exceptions.QuallException):
+  """
+  Base class for all Selenium server lifecycle exceptions.
+  """
+
+  pass
+
+
+class SeleniumServerStartupException(SeleniumServerException):
+  """
+  Signifies that the Selenium server exited or did not become ready in time.
+  """
+
+  pass
+
+
+def _pid_alive(pid):
+  try:
+    os.kill(pid, 0)
+  except OSError as e:
+    return e.errno == errno.EPERM
+  # Reaps the process if it is an exited child of ours.
+  try:
+    if os.waitpid(pid, os.WNOHANG)[0] != 0:
+      return False
+  except OSError:
+    pass
+  # Exited processes awaiting their parent still accept signals on Linux.
+  try:
+    stat_file = open("/proc/%s/stat" % pid, "r")
+    try:
+      return stat_file.read().rsplit(")", 1)[-1].split()[0] != "Z"
+    finally:
+      stat_file.close()
+  except (IOError, IndexError):
+    return True
+
+
+def _process_start_time(pid):
+  """
+  @return: an opaque value identifying when the process started, which
+      distinguishes it from later processes reusing its PID, or None if it
+      cannot be determined
+  @rtype: str
+  """
+
+  try:
+    stat_file = open("/proc/%s/stat" % pid, "r")
+    try:
+      # Field 22, the start time in clock ticks since boot, counting from the
+      # first field after the parenthesized command name (field 3).
+      return stat_file.read().rsplit(")", 1)[-1].split()[19]
+    finally:
+      stat_file.close()
+  except (IOError, IndexError):
+    pass
+  # Platforms without /proc.
+  null_file = open(os.devnull, "w")
+  try:
+    ps = subprocess.Popen(["ps", "-o", "lstart=", "-p", str(pid)],
+        stdout = subprocess.PIPE, stderr = null_file)
+    return ps.communicate()[0].strip() or None
+  except OSError:
+    return None
+  finally:
+    null_file.close()
+
+
+def _process_alive(pid, start_time):
+  # Whether the identified process, rather than just some process with its
+  # PID, is still running.
+  return _pid_alive(pid) and _process_start_time(pid) == start_time
+
+
+class SeleniumServer(object):
+  """A Selenium server process shared by every driver session and worker
+  process that uses the same jar and arguments.
+  """
+
+  DEFAULT_STATE_DIR = os.path.join(tempfile.gettempdir(), "quall-selenium")
+  STATUS_PATH = "/wd/hub/status"
+  HUB_PATH = "/wd/hub"
+  INITIAL_POLL_INTERVAL = 0.05
+  MAX_POLL_INTERVAL = 1.0
+
+  log = logging.getLogger("quall.webdriver.server")
+
+  def __init__(self, jar_path, port, args = "", java = "java",
+      state_dir = None, shared = True):
+    """
+    @param jar_path: the local path of the Selenium server jar
+    @type jar_path: str
+    @param port: the port to listen on if a new server is started
+    @type port: int
+    @param args: additional command-line arguments for the server
+    @type args: str
+    @param java: the Java executable to launch the server with
+    @type java: str
+    @param state_dir: the directory holding shared server state files
+    @type state_dir: str
+    @param shared: whether to share the server with other processes
+    @type shared: boolean
+    """
+
+    self.jar_path = jar_path
+    self.args = args or ""
+    self.port = port
+    self.java = java
+    self.state_dir = state_dir or self.DEFAULT_STATE_DIR
+    self.shared = shared
+    self.process = None
+    self.pid = None
+    self.start_time = None
+    server_key = hashlib.sha1("%s %s %s" % (java, jar_path, self.args))
+    self.state_path = os.path.join(self.state_dir,
+        "selenium-%s.json" % server_key.hexdigest())
+
+  def _read_state(self):
+    if not os.path.exists(self.state_path):
+      return None
+    state_file = open(self.state_path, "r")
+    try:
+      return json.load(state_file)
+    except ValueError:
+      return None
+    finally:
+      state_file.close()
+
+  def _write_state(self, state):
+    if state is None:
+      if os.path.exists(self.state_path):
+        os.remove(self.state_path)
+      return
+    (fd, temp_path) = tempfile.mkstemp(dir = self.state_dir)
+    try:
+      os.write(fd, json.dumps(state))
+    finally:
+      os.close(fd)
+    os.rename(temp_path, self.state_path)
+
+  def _lock(self):
+    if not os.path.isdir(self.state_dir):
+      try:
+        os.makedirs(self.state_dir)
+      except OSError:
+        if not os.path.isdir(self.state_dir):
+          raise
+    return FileLock("%s.lock" % self.state_path)
+
+  def _spawn(self):
+    command = "exec %s -jar %s %s -port %s" % (self.java, self.jar_path,
+        self.args, self.port)
+    self.log.info("Starting Selenium server: %s" % command)
+    # Output goes to a log file; an unread pipe would eventually block the
+    # server once its buffer fills.
+    log_file = open(os.path.join(self.state_dir,
+        "selenium-%s.log" % self.port), "ab")
+    null_file = open(os.devnull, "r")
+    try:
+      # Runs the server in its own process group so the whole group can be
+      # signalled and so it outlives this process if others still use it.
+      self.process = subprocess.Popen(command, shell = True,
+          stdin = null_file, stdout = log_file, stderr = subprocess.STDOUT,
+          preexec_fn = os.setsid)
+    finally:
+      null_file.close()
+      log_file.close()
+    self.pid = self.process.pid
+    self.start_time = _process_start_time(self.pid)
+
+  def _is_running(self):
+    if self.process is not None:
+      return self.process.poll() is None
+    return self.pid is not None and _process_alive(self.pid, self.start_time)
+
+  def _user(self):
+    return [os.getpid(), _process_start_time(os.getpid())]
+
+  def _live_users(self, state):
+    return [user for user in state["users"] if _process_alive(*user)]
+
+  def get_url(self):
+    """
+    @return: the WebDriver hub URL of the server
+    @rtype: str
+    """
+
+    return "http://localhost:%s%s" % (self.port, self.HUB_PATH)
+
+  def is_ready(self):
+    """
+    @return: whether the server's status endpoint is answering
+    @rtype: boolean
+    """
+
+    try:
+      response = urllib2.urlopen("http://localhost:%s%s" % (self.port,
+          self.STATUS_PATH), timeout = 1)
+      try:
+        return response.getcode() == 200
+      finally:
+        response.close()
+    except Exception:
+      return False
+
+  def wait_until_ready(self, timeout = 60):
+    """
+    Polls the server's status endpoint with exponential backoff until it
+    answers.
+
+    @param timeout: seconds to wait before giving up
+    @type timeout: float
+
+    @raise SeleniumServerStartupException: if the server exits or does not
+        become ready within the timeout
+    """
+
+    start = time.time()
+    deadline = start + timeout
+    interval = self.INITIAL_POLL_INTERVAL
+    while not self.is_ready():
+      if not self._is_running():
+        raise SeleniumServerStartupException(
+            "Selenium server on port %s exited during startup" % self.port)
+      if time.time() >= deadline:
+        raise SeleniumServerStartupException(
+            "Selenium server on port %s was not ready within %s seconds" % (
+                self.port, timeout))
+      time.sleep(min(interval, max(deadline - time.time(), 0)))
+      interval = min(interval * 2, self.MAX_POLL_INTERVAL)
+    self.log.info("Selenium server ready on port %s after %.2f seconds" % (
+        self.port, time.time() - start))
+
+  def start(self, timeout = 60):
+    """
+    Attaches to a running shared server or starts a new one, returning once it
+    is ready to accept sessions.
+
+    @param timeout: seconds to wait for the server to become ready
+    @type timeout: float
+
+    @raise SeleniumServerStartupException: if the server does not start
+    """
+
+    with self._lock():
+      state = None
+      if self.shared:
+        state = self._read_state()
+      if state is not None and _process_alive(state["pid"],
+          state.get("start_time")):
+        self.log.info("Attaching to Selenium server on port %s" %
+            state["port"])
+        (self.pid, self.start_time, self.port) = (state["pid"],
+            state["start_time"], state["port"])
+      else:
+        if state is not None:
+          self.log.info("Discarding stale Selenium server state for PID %s" %
+              state["pid"])
+        self._spawn()
+        state = {"pid": self.pid, "start_time": self.start_time,
+            "port": self.port, "users": []}
+      if self.shared:
+        state["users"] = self._live_users(state)
+        state["users"].append(self._user())
+        self._write_state(state)
+    try:
+      self.wait_until_ready(timeout)
+    except SeleniumServerStartupException:
+      self.stop()
+      raise
+
+  def _wait_for_exit(self, grace_period):
+    deadline = time.time() + grace_period
+    interval = self.INITIAL_POLL_INTERVAL
+    while self._is_running():
+      if time.time() >= deadline:
+        return False
+      time.sleep(min(interval, max(deadline - time.time(), 0)))
+      interval = min(interval * 2, self.MAX_POLL_INTERVAL)
+    return True
+
+  def _signal_group(self, signum):
+    # Never signals the group of an unrelated process that reused the PID.
+    if not self._is_running():
+      return
+    try:
+      os.killpg(self.pid, signum)
+    except OSError as e:
+      if e.errno != errno.ESRCH:
+        raise
+
+  def stop(self, grace_period = 5):
+    """
+    Detaches from the server, terminating it if no other process is still
+    using it.  The process group is killed if it has not exited within the
+    grace period.
+
+    @param grace_period: seconds to wait after SIGTERM before sending SIGKILL
+    @type grace_period: float
+    """
+
+    if self.pid is None:
+      return
+    with self._lock():
+      if self.shared:
+        state = self._read_state()
+        if (state is not None and state["pid"] == self.pid and
+            state.get("start_time") == self.start_time):
+          if self._user() in state["users"]:
+            state["users"].remove(self._user())
+          state["users"] = self._live_users(state)
+          if state["users"] and self._is_running():
+            self.log.info("Detaching from Selenium server still used by %s" %
+                state["users"])
+            self._write_state(state)
+            self.pid = None
+            self.start_time = None
+            return
+          self._write_state(None)
+      self.log.info("Terminating Selenium server on port %s..." % self.port)
+      self._signal_group(signal.SIGTERM)
+      if not self._wait_for_exit(grace_period):
+        self.log.info("Killing Selenium server on port %s..." % self.port)
+        self._signal_group(signal.SIGKILL)
+        self._wait_for_exit(grace_period)
+      self.pid = None
+      self.start_time = None
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+    quall.mixins.webdriver.waits
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Provides conditions and timing statistics for explicit WebDriver waits.
+
+    Conditions are evaluated against the element states returned by
+    C{WebDriverMixin.resolve_elements}, so any number of conditions can be
+    checked with one round trip per poll.
+
+    Example::
+      self.wait_for([Visible(login_button), Gone(spinner)], timeout = 10)
+"""
+
+
+import re
+import threading
+
+
+class Condition(object):
+  """Base class for conditions on a single element's state.
+  """
+
+  def __init__(self, element):
+    self.element = element
+
+  def __str__(self):
+    return "%s %s" % (self.__class__.__name__.lower(), self.element)
+
+  def is_met(self, state):
+    """
+    @param state: the element state, as returned by C{resolve_elements}
+    @type state: dict
+
+    @rtype: boolean
+    """
+
+    raise NotImplementedError
+
+
+class Present(Condition):
+  """The element exists in the document.
+  """
+
+  def is_met(self, state):
+    return state["present"]
+
+
+class Visible(Condition):
+  """The element exists and is displayed.
+  """
+
+  def is_met(self, state):
+    return state["present"] and state["visible"]
+
+
+class Gone(Condition):
+  """The element is absent from the document or is not displayed.
+  """
+
+  def is_met(self, state):
+    return not (state["present"] and state["visible"])
+
+
+class TextMatches(Condition):
+  """The element exists and its text matches a regular expression.
+  """
+
+  def __init__(self, element, pattern):
+    super(TextMatches, self).__init__(element)
+    self.pattern = re.compile(pattern)
+
+  def __str__(self):
+    return "text of %s matches %r" % (self.element, self.pattern.pattern)
+
+  def is_met(self, state):
+    return (state["present"] and state["text"] is not None and
+        self.pattern.search(state["text"]) is not None)
+
+
+class WaitStatistics(object):
+  """Records how long each kind of wait took, so timeouts can be tuned from
+  observed data.
+  """
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._waits = {}
+
+  def record(self, description, elapsed, polls, satisfied):
+    """
+    @param description: a stable name for the wait, e.g. its conditions
+    @type description: str
+    @param elapsed: seconds the wait took
+    @type elapsed: float
+    @param polls: the number of times the conditions were evaluated
+    @type polls: int
+    @param satisfied: whether the wait succeeded before its deadline
+    @type satisfied: boolean
+    """
+
+    with self._lock:
+      stats = self._waits.setdefault(description, {"count": 0, "timeouts": 0,
+          "total": 0.0, "max": 0.0, "polls": 0})
+      stats["count"] += 1
+      stats["total"] += elapsed
+      stats["max"] = max(stats["max"], elapsed)
+      stats["polls"] += polls
+      if not satisfied:
+        stats["timeouts"] += 1
+
+  def summary(self):
+    """
+    @return: per-description dicts with count, timeouts, mean, max and polls
+    @rtype: dict
+    """
+
+    with self._lock:
+      summary = {}
+      for (description, stats) in self._waits.items():
+        summary[description] = dict(stats)
+        summary[description]["mean"] = stats["total"] / stats["count"]
+      return summary
+
+  def reset(self):
+    with self._lock:
+      self._waits = {}
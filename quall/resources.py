@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+"""
+    quall.resources
+    ~~~~~~~~~~~~~~~
+
+    Provides a scoped, reference-counted manager for expensive shared test
+    resources such as SSH transports, WebDriver sessions and Selenium servers.
+
+    Resources are registered against a scope and a key; the first caller to
+    acquire a key creates it and every later caller receives the same object.
+    Each acquisition holds a reference, and a resource is finalized when its
+    last holder releases it or when its scope ends, whichever comes first.
+    Resources acquired with C{retain = True} are also held by their scope, so
+    they outlive their holders and are shared until the scope ends.  When a
+    scope ends, its resources are finalized in the reverse order of their
+    creation.
+
+    Example::
+      @before_class
+      def setup(self):
+        self.enter_resource_scope(quall.resources.CLASS)
+
+      @after_class
+      def teardown(self):
+        self.exit_resource_scope(quall.resources.CLASS)
+"""
+
+
+import atexit
+import logging
+import threading
+import traceback
+
+import quall.exceptions
+
+
+PROCESS = "process"
+SESSION = "session"
+GROUP = "group"
+CLASS = "class"
+
+# Scopes ordered from the longest-lived to the shortest-lived.
+SCOPES = (PROCESS, SESSION, GROUP, CLASS)
+
+
+class ResourceException(quall.exceptions.QuallException):
+  """
+  Base class for all Quall resource management exceptions.
+  """
+
+  pass
+
+
+class UnknownScopeException(ResourceException):
+  """
+  Signifies that an unrecognized resource scope was requested.
+  """
+
+  pass
+
+
+class _Resource(object):
+  """
+  Book-keeping record for a single managed resource.
+  """
+
+  def __init__(self, key, value, finalizer, scope):
+    self.key = key
+    self.value = value
+    self.finalizer = finalizer
+    self.scope = scope
+    self.refcount = 0
+    self.retained = False
+
+
+class ResourceManager(object):
+  """Hands out shared resources and tears them down when their scope ends.
+
+  Each key identifies at most one resource, which lives in exactly one scope.
+  Each scope keeps an ordered list of the resources created within it, so a
+  transport retained at session scope is reused by every class.
+  """
+
+  log = logging.getLogger("quall.resources")
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._resources = dict((scope, []) for scope in SCOPES)
+    self._index = {}
+    self._pending = {}
+
+  def _check_scope(self, scope):
+    if scope not in SCOPES:
+      raise UnknownScopeException(
+          "Unknown resource scope %s; expected one of %s" % (scope,
+              ", ".join(SCOPES)))
+
+  def _promote(self, resource, scope):
+    # Moves a resource into a longer-lived scope if one is requested for it.
+    if SCOPES.index(scope) >= SCOPES.index(resource.scope):
+      return
+    self.log.debug("Promoting resource %s from %s to %s scope" % (
+        resource.key, resource.scope, scope))
+    self._resources[resource.scope].remove(resource)
+    self._resources[scope].append(resource)
+    resource.scope = scope
+
+  def _forget(self, resource):
+    # Must be called with the lock held; returns whether it was still managed.
+    if self._index.get(resource.key) is not resource:
+      return False
+    del self._index[resource.key]
+    self._resources[resource.scope].remove(resource)
+    return True
+
+  def _finalize(self, resource):
+    if resource.finalizer is None:
+      return
+    try:
+      self.log.debug("Finalizing resource: %s" % (resource.key,))
+      resource.finalizer(resource.value)
+    except Exception:
+      self.log.warning("Failed to finalize resource %s:\n%s" % (
+          resource.key, traceback.format_exc()))
+
+  def acquire(self, scope, key, factory, finalizer = None, validator = None,
+      retain = False):
+    """
+    Obtains the resource registered under the supplied key, creating it within
+    the requested scope if it does not yet exist, and takes a reference to it
+    which must be given back with L{release}.  An existing resource is moved
+    into the requested scope if that scope outlives its own.
+
+    The factory and validator run without the manager's lock held, so slow
+    resources such as SSH transports and browsers are created concurrently;
+    callers acquiring a key that is still being created wait for it.
+
+    @param scope: the scope the resource should live in
+    @type scope: str
+    @param key: a hashable key identifying the resource
+    @type key: tuple
+    @param factory: a callable taking no arguments which creates the resource
+    @type factory: callable
+    @param finalizer: a callable taking the resource which tears it down
+    @type finalizer: callable
+    @param validator: a callable taking the resource which returns False if
+        the resource is no longer usable and must be recreated
+    @type validator: callable
+    @param retain: whether the scope also holds the resource, so that it is
+        kept until the scope ends even once every holder has released it
+    @type retain: boolean
+
+    @return: the shared resource
+    @rtype: object
+
+    @raise UnknownScopeException: if the requested scope is not recognized
+    """
+
+    self._check_scope(scope)
+    while True:
+      with self._lock:
+        pending = self._pending.get(key)
+        resource = None
+        if pending is None:
+          resource = self._index.get(key)
+          if resource is None:
+            created = self._pending[key] = threading.Event()
+            break
+          self._promote(resource, scope)
+          # Holds the resource while it is validated.
+          resource.refcount += 1
+      if pending is not None:
+        # Another thread is creating this resource; waits for it to finish.
+        pending.wait()
+        continue
+      if validator is None or validator(resource.value):
+        with self._lock:
+          resource.retained = resource.retained or retain
+        return resource.value
+      self.log.info("Discarding stale resource: %s" % (key,))
+      with self._lock:
+        resource.refcount -= 1
+        stale = self._forget(resource)
+      if stale:
+        self._finalize(resource)
+    self.log.debug("Creating %s-scoped resource: %s" % (scope, key))
+    try:
+      value = factory()
+    except:
+      with self._lock:
+        del self._pending[key]
+      created.set()
+      raise
+    with self._lock:
+      del self._pending[key]
+      resource = _Resource(key, value, finalizer, scope)
+      resource.refcount = 1
+      resource.retained = retain
+      self._resources[scope].append(resource)
+      self._index[key] = resource
+    created.set()
+    return value
+
+  def release(self, key):
+    """
+    Gives back a reference taken by L{acquire}, finalizing the resource if it
+    was the last one and the resource is not retained by its scope.
+
+    @param key: the key the resource was acquired with
+    @type key: tuple
+
+    @return: the number of references still held
+    @rtype: int
+    """
+
+    with self._lock:
+      resource = self._index.get(key)
+      if resource is None:
+        self.log.warning("Released unknown resource: %s" % (key,))
+        return 0
+      resource.refcount = max(resource.refcount - 1, 0)
+      if resource.refcount > 0 or resource.retained:
+        return resource.refcount
+      self._forget(resource)
+    self.log.debug("Last reference to %s released" % (key,))
+    self._finalize(resource)
+    return 0
+
+  def discard(self, key):
+    """
+    Immediately finalizes and forgets the resource registered under the
+    supplied key, e.g. after it has been found to be broken, whatever
+    references are still held to it.
+
+    @param key: the key the resource was acquired with
+    @type key: tuple
+    """
+
+    with self._lock:
+      resource = self._index.get(key)
+      if resource is None or not self._forget(resource):
+        return
+    self._finalize(resource)
+
+  def enter_scope(self, scope):
+    """
+    Marks the beginning of a scope.  Any resources left over from a previous
+    instance of the scope are torn down first.
+
+    @param scope: the scope being entered
+    @type scope: str
+    """
+
+    self._check_scope(scope)
+    self.exit_scope(scope)
+    self.log.debug("Entering %s scope" % scope)
+
+  def exit_scope(self, scope):
+    """
+    Marks the end of a scope, finalizing every resource created within it and
+    within any shorter-lived scope in the reverse order of their creation,
+    whatever references are still held to them.
+
+    @param scope: the scope being exited
+    @type scope: str
+    """
+
+    self._check_scope(scope)
+    ending = []
+    with self._lock:
+      for ending_scope in reversed(SCOPES[SCOPES.index(scope):]):
+        resources = self._resources[ending_scope]
+        self._resources[ending_scope] = []
+        for resource in reversed(resources):
+          del self._index[resource.key]
+          if resource.refcount > 0:
+            self.log.debug("Resource %s still has %s reference(s) at end of "
+                "%s scope" % (resource.key, resource.refcount, ending_scope))
+          ending.append(resource)
+    for resource in ending:
+      self._finalize(resource)
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_resource_manager():
+  """
+  Returns the process-wide L{ResourceManager}, creating it on first use.  The
+  process scope is torn down automatically at interpreter exit.
+
+  @rtype: ResourceManager
+  """
+
+  global _manager
+  with _manager_lock:
+    if _manager is None:
+      _manager = ResourceManager()
+      atexit.register(_manager.exit_scope, PROCESS)
+    return _manager
@@ -1,5 +1,6 @@
 from quall.base import QuallBase
 from quall.mixins.ssh import SSHClientMixin
+from quall.mixins.webdriver import WebDriverMixin
 from tests import *
 
 from proboscis import SkipTest
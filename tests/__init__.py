@@ -1 +1,2 @@
-__all__ = ['example']
+__all__ = ['example', 'locator_benchmark', 'distributed_loopback',
+    'resource_manager', 'artifact_cache']
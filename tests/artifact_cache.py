@@ -0,0 +1,95 @@
+import hashlib
+import os
+import shutil
+import tempfile
+
+from proboscis.asserts import *
+from proboscis import after_class
+from proboscis import before_class
+from proboscis import test
+
+from quall.cache import ArtifactCache
+from quall.cache import ArtifactCacheException
+
+
+@test(groups=['cache'])
+class ArtifactCacheTests():
+  @before_class
+  def create_sources(self):
+    """Creates a scratch directory for artifact sources and caches."""
+    self.base_dir = tempfile.mkdtemp()
+    self.source_path = os.path.join(self.base_dir, "selenium.jar")
+    self.url = "file://%s" % self.source_path
+
+  @after_class
+  def remove_sources(self):
+    shutil.rmtree(self.base_dir)
+
+  def publish(self, contents, path = None):
+    # Writes an artifact source and returns its pinned SHA-256 checksum.
+    artifact = open(path or self.source_path, "wb")
+    try:
+      artifact.write(contents)
+    finally:
+      artifact.close()
+    return "sha256:%s" % hashlib.sha256(contents).hexdigest()
+
+  def read(self, path):
+    artifact = open(path, "rb")
+    try:
+      return artifact.read()
+    finally:
+      artifact.close()
+
+  def create_cache(self):
+    return ArtifactCache(tempfile.mkdtemp(dir = self.base_dir))
+
+  @test
+  def miss_then_hit(self):
+    """The first fetch retrieves the artifact and later ones reuse it."""
+    cache = self.create_cache()
+    checksum = self.publish("release 1")
+    path = cache.fetch(self.url, checksum = checksum)
+    assert_equal("release 1", self.read(path))
+    os.remove(self.source_path)
+    assert_equal(path, cache.fetch(self.url, checksum = checksum))
+    assert_equal(path, cache.fetch(self.url))
+
+  @test
+  def checksum_mismatch_is_rejected(self):
+    """An artifact not matching its pinned checksum is neither returned nor
+    cached."""
+    cache = self.create_cache()
+    checksum = self.publish("release 1")
+    self.publish("tampered")
+    assert_raises(ArtifactCacheException, cache.fetch, self.url,
+        checksum = checksum)
+    assert_equal([], os.listdir(cache.objects_dir))
+
+  @test
+  def pinned_checksum_overrides_url_index(self):
+    """A URL indexed to another artifact misses when a different SHA-256 is
+    pinned."""
+    cache = self.create_cache()
+    self.publish("release 1")
+    old_path = cache.fetch(self.url)
+    checksum = self.publish("release 2")
+    new_path = cache.fetch(self.url, checksum = checksum)
+    assert_not_equal(old_path, new_path)
+    assert_equal("release 2", self.read(new_path))
+
+  @test
+  def falls_back_through_mirrors(self):
+    """Unavailable or corrupt mirrors are skipped in favour of the next
+    source."""
+    cache = self.create_cache()
+    checksum = self.publish("release 1")
+    corrupt_mirror = os.path.join(self.base_dir, "corrupt.jar")
+    self.publish("corrupt", corrupt_mirror)
+    good_mirror = os.path.join(self.base_dir, "mirror.jar")
+    self.publish("release 1", good_mirror)
+    os.remove(self.source_path)
+    path = cache.fetch(self.url, checksum = checksum,
+        mirrors = [os.path.join(self.base_dir, "missing.jar"), corrupt_mirror,
+            good_mirror])
+    assert_equal("release 1", self.read(path))
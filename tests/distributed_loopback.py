@@ -0,0 +1,261 @@
+import optparse
+import os
+import select
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+
+from proboscis.asserts import *
+from proboscis import after_class
+from proboscis import before_class
+from proboscis import test
+
+import quall
+import quall.metrics
+from quall.distributed import DistributedRunner
+
+
+# Proboscis tests run by the loopback workers.  The chatty test writes more to
+# stderr than a pipe buffers, so it only finishes if stderr is drained.  The
+# crashing test's last words must reach the shard's report.
+FIXTURE_TESTS = """
+import os
+import sys
+import time
+
+from proboscis import test
+
+import quall.metrics
+
+
+@test(groups=['loopback_pass'])
+class First(object):
+  @test
+  def check(self):
+    quall.metrics.registry.increment("fixture_checks_total")
+
+
+@test(groups=['loopback_pass'])
+class Second(object):
+  @test
+  def check(self):
+    pass
+
+
+@test(groups=['loopback_chatty'])
+class Chatty(object):
+  @test
+  def check(self):
+    sys.stderr.write("x" * (1 << 20))
+
+
+@test(groups=['loopback_crash'])
+def crash():
+  sys.stderr.write("fixture crashed on purpose\\n")
+  os._exit(3)
+
+
+@test(groups=['loopback_hang'])
+def hang():
+  time.sleep(60)
+"""
+
+FIXTURE_WORKER = """
+import optparse
+
+import quall.distributed
+import quall.metrics
+import fixture_tests
+
+parser = optparse.OptionParser()
+parser.add_option("--worker", action = "store_true")
+parser.add_option("-e", dest = "environment")
+parser.add_option("-c", dest = "config_file")
+parser.add_option("-g", dest = "groups")
+(options, args) = parser.parse_args()
+quall.metrics.registry.enabled = True
+quall.distributed.run_worker(options.groups.split(","))
+"""
+
+
+class LoopbackChannel(object):
+  """Runs a command as a local process behind the subset of the
+  paramiko.Channel interface the distributed runner uses.  Like a paramiko
+  channel, unread stderr is never consumed on the reader's behalf.
+  """
+
+  def __init__(self):
+    self.process = None
+    self.timeout = None
+    self._stderr = ""
+    self._stderr_eof = False
+
+  def settimeout(self, timeout):
+    self.timeout = timeout
+
+  def exec_command(self, command):
+    self.process = subprocess.Popen(command, shell = True,
+        stdout = subprocess.PIPE, stderr = subprocess.PIPE,
+        preexec_fn = os.setsid)
+
+  def recv(self, size):
+    if not select.select([self.process.stdout], [], [], self.timeout)[0]:
+      raise socket.timeout()
+    return os.read(self.process.stdout.fileno(), size)
+
+  def recv_stderr_ready(self):
+    if not self._stderr and not self._stderr_eof and select.select(
+        [self.process.stderr], [], [], 0)[0]:
+      self._stderr = os.read(self.process.stderr.fileno(), 65536)
+      self._stderr_eof = self._stderr == ""
+    return self._stderr != ""
+
+  def recv_stderr(self, size):
+    (data, self._stderr) = (self._stderr[:size], self._stderr[size:])
+    return data
+
+  def recv_exit_status(self):
+    return self.process.wait()
+
+  def close(self):
+    if self.process.poll() is None:
+      os.killpg(self.process.pid, signal.SIGKILL)
+      self.process.wait()
+
+
+class LoopbackTransport(object):
+
+  def __init__(self):
+    self.channels = []
+    self.active = True
+
+  def open_session(self):
+    self.channels.append(LoopbackChannel())
+    return self.channels[-1]
+
+  def is_active(self):
+    return self.active
+
+  def close(self):
+    self.active = False
+    for channel in self.channels:
+      channel.close()
+
+
+class LoopbackHarness(object):
+  """Stands in for an SSHClientMixin harness, running every worker command
+  on this host.
+  """
+
+  def __init__(self, config, config_file):
+    self.config = config
+    self.options = optparse.Values({"environment": "default",
+        "config_file": config_file})
+
+  def ssh_command(self, hostname, command, username = "root", password = "",
+      ssh_port = 22):
+    process = subprocess.Popen(command, shell = True,
+        stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+    (stdout, stderr) = process.communicate()
+    return (process.returncode, stdout, stderr)
+
+  def put_remote_file(self, hostname, local_path, remote_path, **kwargs):
+    shutil.copyfile(local_path, remote_path)
+
+  def get_ssh_transport(self, hostname, username = "root", password = "",
+      ssh_port = 22):
+    return LoopbackTransport()
+
+
+@test(groups=['distributed'])
+class DistributedLoopbackTests():
+  @before_class
+  def create_tree(self):
+    """Builds a test tree for the workers to run and enters it."""
+    self.base_dir = tempfile.mkdtemp()
+    shutil.copytree(os.path.dirname(os.path.abspath(quall.__file__)),
+        os.path.join(self.base_dir, "quall"))
+    for (name, source) in (("fixture_tests.py", FIXTURE_TESTS),
+        ("fixture_worker.py", FIXTURE_WORKER), ("config.yml", "default: {}\n")):
+      fixture_file = open(os.path.join(self.base_dir, name), "w")
+      try:
+        fixture_file.write(source)
+      finally:
+        fixture_file.close()
+    self.cwd = os.getcwd()
+    os.chdir(self.base_dir)
+
+  @after_class
+  def remove_tree(self):
+    """Leaves and removes the test tree and the worker directories."""
+    os.chdir(self.cwd)
+    shutil.rmtree(self.base_dir)
+
+  def run_shards(self, shards, **options):
+    distributed = {
+      "workers": [{"host": "localhost",
+          "workdir": os.path.join(self.base_dir, "worker-%s" % index)}
+          for index in range(2)],
+      "command": "%s fixture_worker.py" % sys.executable,
+      "bundle_paths": ["quall", "fixture_tests.py", "fixture_worker.py"],
+      "max_attempts": 3,
+      "idle_timeout": 20,
+    }
+    distributed.update(options)
+    harness = LoopbackHarness({"distributed": distributed},
+        os.path.join(self.base_dir, "config.yml"))
+    return DistributedRunner(harness, shards).run()
+
+  @test
+  def merges_results_under_qualified_names(self):
+    """Same-named methods in different classes are reported separately."""
+    report = self.run_shards([["loopback_pass"], ["loopback_chatty"]])
+    assert_true(report["success"])
+    assert_equal(["fixture_tests.Chatty.check", "fixture_tests.First.check",
+        "fixture_tests.Second.check"],
+        sorted(result["test"] for result in report["results"]))
+
+  @test
+  def crashing_shard_does_not_retire_workers(self):
+    """A shard that crashes its interpreter is retried on healthy workers."""
+    report = self.run_shards([["loopback_crash"], ["loopback_pass"]])
+    (crash, passing) = report["shards"]
+    assert_equal(3, crash["attempts"])
+    assert_true(crash["error"].startswith("Gave up after 3 attempts: "))
+    assert_equal(None, passing["error"])
+    assert_equal(2, report["summary"]["pass"])
+
+  @test
+  def crash_report_includes_stderr_tail(self):
+    """Whatever a crashing shard wrote to stderr as it died is reported."""
+    report = self.run_shards([["loopback_crash"]], max_attempts = 1)
+    error = report["shards"][0]["error"]
+    assert_true("exited with status 3" in error)
+    assert_true(error.endswith("fixture crashed on purpose\n"))
+
+  @test
+  def hung_worker_times_out(self):
+    """A shard that outlives the shard timeout fails its worker."""
+    report = self.run_shards([["loopback_hang"]], shard_timeout = 2,
+        max_attempts = 1)
+    assert_true("did not finish shard loopback_hang within" in
+        report["shards"][0]["error"])
+    assert_true(report["elapsed"] < 30)
+
+  @test
+  def merges_worker_metrics(self):
+    """Per-test metrics recorded on workers reach the coordinator's export."""
+    quall.metrics.registry.enabled = True
+    try:
+      self.run_shards([["loopback_pass"]])
+      counters = quall.metrics.registry.summary()["counters"]
+    finally:
+      quall.metrics.registry.enabled = False
+      quall.metrics.registry.reset()
+    assert_equal(1, len(counters))
+    assert_equal("fixture_checks_total", counters[0]["name"])
+    assert_equal("fixture_tests.First.check", counters[0]["labels"]["test"])
+    assert_true(counters[0]["labels"]["worker"] in ("worker-0", "worker-1"))
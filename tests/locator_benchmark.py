@@ -0,0 +1,142 @@
+import os
+import tempfile
+import time
+
+import selenium.webdriver
+
+from proboscis.asserts import *
+from proboscis import after_class
+from proboscis import before_class
+from proboscis import test
+
+from quall.mixins.webdriver import WebDriverMixin
+from quall.mixins.webdriver.abstractions import BasicStrategies
+from quall.mixins.webdriver.abstractions import Element
+
+
+# Number of each kind of element in the fixture page; targets sit at the end
+# of the document, the worst case for a full-document scan.
+FIXTURE_SIZE = int(os.environ.get("QUALL_BENCHMARK_SIZE", 2000))
+ROUNDS = int(os.environ.get("QUALL_BENCHMARK_ROUNDS", 50))
+DRIVER = os.environ.get("QUALL_BENCHMARK_DRIVER", "PhantomJS")
+
+
+# Attributes with stray whitespace, which the normalize-space() templates must
+# still match, and a padded value, which the raw button template must not.
+PADDED_FIXTURE = ('<div id=" pad-id " title=" pad  title "'
+    ' class="btn  primary "><img alt=" pad-alt " src="">'
+    '<input type="button" name=" pad-name " value=" pad-value ">'
+    '<input type="button" value="pad-value"></div>')
+
+
+def build_fixture(size):
+  """Writes an HTML page exercising every BasicStrategies template."""
+  rows = []
+  for i in xrange(size):
+    rows.append(
+        '<div id="el-%(i)s" title="title-%(i)s" class="cls-%(i)s">'
+        '<img alt="alt-%(i)s" src="">'
+        '<input type="button" name="name-%(i)s" value="value-%(i)s">'
+        '<a href="#%(i)s">link-%(i)s</a></div>' % {"i": i})
+  table_rows = ["<tr><td>row-%(i)s</td><td>col-%(i)s</td>"
+      '<td><input type="checkbox"></td></tr>' % {"i": i}
+      for i in xrange(size)]
+  (fd, path) = tempfile.mkstemp(suffix = ".html")
+  os.write(fd, "<html><body>%s%s<table>%s</table></body></html>" % (
+      "".join(rows), PADDED_FIXTURE, "".join(table_rows)))
+  os.close(fd)
+  return path
+
+
+def time_lookup(driver, by, value):
+  start = time.time()
+  for i in xrange(ROUNDS):
+    found = driver.find_elements(by = by, value = value)
+  return ((time.time() - start) / ROUNDS, found)
+
+
+@test(groups=['benchmark'])
+class LocatorBenchmark():
+  @before_class
+  def start_browser(self):
+    """Opens the fixture page in a local headless browser."""
+    self.fixture = build_fixture(FIXTURE_SIZE)
+    self.driver = getattr(selenium.webdriver, DRIVER)()
+    self.driver.get("file://%s" % self.fixture)
+    last = FIXTURE_SIZE - 1
+    # Each target names the attribute its template compares, if any, so its
+    # XPath can be raced against the native lookups for that attribute.
+    self.targets = [
+      ("id", "id", Element("el-%s" % last, strategy = BasicStrategies.id)),
+      ("name", "name",
+          Element("name-%s" % last, strategy = BasicStrategies.name)),
+      ("alt", "alt", Element("alt-%s" % last, strategy = BasicStrategies.alt)),
+      ("title", "title",
+          Element("title-%s" % last, strategy = BasicStrategies.title)),
+      ("css_class", "class",
+          Element("cls-%s" % last, strategy = BasicStrategies.css_class)),
+      ("button", "value",
+          Element("value-%s" % last, strategy = BasicStrategies.button)),
+      ("link", None,
+          Element("link-%s" % last, strategy = BasicStrategies.link)),
+      ("row_with_two_elements", None, Element("row-%s" % last,
+          "col-%s" % last, strategy = BasicStrategies.row_with_two_elements)),
+      ("checkbox_next_to_text", None, Element("row-%s" % last,
+          strategy = BasicStrategies.checkbox_next_to_text)),
+      ("padded id", "id",
+          Element("pad-id", strategy = BasicStrategies.id)),
+      ("padded name", "name",
+          Element("pad-name", strategy = BasicStrategies.name)),
+      ("padded alt", "alt",
+          Element("pad-alt", strategy = BasicStrategies.alt)),
+      ("padded title", "title",
+          Element("pad title", strategy = BasicStrategies.title)),
+      ("padded css_class", "class",
+          Element("btn primary", strategy = BasicStrategies.css_class)),
+      ("padded button", "value",
+          Element("pad-value", strategy = BasicStrategies.button)),
+    ]
+
+  @after_class
+  def stop_browser(self):
+    """Closes the browser and removes the fixture page."""
+    self.driver.quit()
+    os.remove(self.fixture)
+
+  def native_lookups(self, attribute, value):
+    """Lists the native lookups that could stand in for an attribute XPath."""
+    lookups = [("css", '*[%s="%s"]' % (attribute, value))]
+    if attribute in ("id", "name"):
+      lookups.insert(0, (attribute, value))
+    return lookups
+
+  @test
+  def compare_lookup_latency(self):
+    """Times each strategy's XPath against its compiled lookup and, where the
+    XPath is kept, against the native lookups it could have used instead.
+    The last column shows whether a lookup finds what the XPath finds."""
+    print "%-24s %-6s %12s %12s %6s" % ("strategy", "lookup", "xpath ms",
+        "lookup ms", "same")
+    for (name, attribute, element) in self.targets:
+      (strategy, value) = element.get_query()
+      (compiled_time, compiled_found) = time_lookup(self.driver,
+          WebDriverMixin.LOOKUP_STRATEGIES[strategy], value)
+      assert_equal(1, len(compiled_found))
+      if not element.get_locator().startswith("/"):
+        print "%-24s %-6s %12s %12.3f %6s" % (name, strategy, "-",
+            compiled_time * 1000, "-")
+        continue
+      (xpath_time, xpath_found) = time_lookup(self.driver,
+          WebDriverMixin.LOOKUP_STRATEGIES["xpath"], element.get_locator())
+      assert_equal(xpath_found, compiled_found)
+      print "%-24s %-6s %12.3f %12.3f %6s" % (name, strategy,
+          xpath_time * 1000, compiled_time * 1000, "yes")
+      if strategy != "xpath" or attribute is None:
+        continue
+      for (lookup, native_value) in self.native_lookups(attribute,
+          element.args[0]):
+        (native_time, native_found) = time_lookup(self.driver,
+            WebDriverMixin.LOOKUP_STRATEGIES[lookup], native_value)
+        print "%-24s %-6s %12s %12.3f %6s" % ("", lookup, "",
+            native_time * 1000,
+            native_found == xpath_found and "yes" or "no")
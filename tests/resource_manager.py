@@ -0,0 +1,132 @@
+import threading
+import time
+
+from proboscis.asserts import *
+from proboscis import before_class
+from proboscis import test
+
+from quall import resources
+from quall.resources import ResourceManager
+
+
+@test(groups=['resources'])
+class ResourceManagerTests():
+  @before_class
+  def create_manager(self):
+    """Tracks every resource finalized by the manager under test."""
+    self.finalized = []
+
+  def acquire(self, manager, scope, key, **kwargs):
+    return manager.acquire(scope, key, lambda: key,
+        finalizer = self.finalized.append, **kwargs)
+
+  @test
+  def finalizes_on_last_release(self):
+    """A resource is finalized once its last holder releases it."""
+    manager = ResourceManager()
+    del self.finalized[:]
+    self.acquire(manager, resources.CLASS, "browser")
+    self.acquire(manager, resources.CLASS, "browser")
+    assert_equal(1, manager.release("browser"))
+    assert_equal([], self.finalized)
+    assert_equal(0, manager.release("browser"))
+    assert_equal(["browser"], self.finalized)
+
+  @test
+  def retained_resources_outlive_their_holders(self):
+    """A retained resource is kept until its scope ends."""
+    manager = ResourceManager()
+    del self.finalized[:]
+    self.acquire(manager, resources.SESSION, "server", retain = True)
+    assert_equal(0, manager.release("server"))
+    assert_equal("server", self.acquire(manager, resources.SESSION, "server"))
+    assert_equal([], self.finalized)
+    manager.exit_scope(resources.SESSION)
+    assert_equal(["server"], self.finalized)
+
+  @test
+  def scope_end_cascades_in_reverse_order(self):
+    """Ending a scope tears down it and every shorter-lived scope, newest
+    resources first, whatever references are still held."""
+    manager = ResourceManager()
+    del self.finalized[:]
+    self.acquire(manager, resources.PROCESS, "jar")
+    self.acquire(manager, resources.SESSION, "server")
+    self.acquire(manager, resources.SESSION, "transport")
+    self.acquire(manager, resources.GROUP, "pool")
+    self.acquire(manager, resources.CLASS, "browser")
+    manager.exit_scope(resources.CLASS)
+    assert_equal(["browser"], self.finalized)
+    manager.exit_scope(resources.SESSION)
+    assert_equal(["browser", "pool", "transport", "server"], self.finalized)
+    manager.exit_scope(resources.PROCESS)
+    assert_equal(["browser", "pool", "transport", "server", "jar"],
+        self.finalized)
+
+  @test
+  def promotes_to_longer_lived_scope(self):
+    """A class-scoped resource requested at session scope outlives the
+    class."""
+    manager = ResourceManager()
+    del self.finalized[:]
+    self.acquire(manager, resources.CLASS, "transport")
+    self.acquire(manager, resources.SESSION, "transport")
+    manager.exit_scope(resources.CLASS)
+    assert_equal([], self.finalized)
+    manager.exit_scope(resources.SESSION)
+    assert_equal(["transport"], self.finalized)
+
+  @test
+  def replaces_stale_resources(self):
+    """A resource failing validation is finalized and recreated."""
+    manager = ResourceManager()
+    del self.finalized[:]
+    manager.acquire(resources.CLASS, "transport", lambda: "old",
+        finalizer = self.finalized.append)
+    value = manager.acquire(resources.CLASS, "transport", lambda: "new",
+        finalizer = self.finalized.append,
+        validator = lambda transport: transport == "new")
+    assert_equal("new", value)
+    assert_equal(["old"], self.finalized)
+
+  @test
+  def concurrent_acquires_create_once(self):
+    """Concurrent acquires of one key share a single creation, while
+    different keys are created in parallel."""
+    manager = ResourceManager()
+    created = []
+    def factory(key):
+      def create():
+        time.sleep(0.2)
+        created.append(key)
+        return key
+      return create
+    values = []
+    threads = [threading.Thread(target = lambda key = key: values.append(
+        manager.acquire(resources.CLASS, key, factory(key))))
+        for key in ("a", "a", "a", "b")]
+    start = time.time()
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    assert_true(time.time() - start < 0.35)
+    assert_equal(["a", "b"], sorted(created))
+    assert_equal(["a", "a", "a", "b"], sorted(values))
+    assert_equal(2, manager.release("a"))
+
+  @test
+  def failed_creation_is_not_cached(self):
+    """A factory failure propagates and the next acquire tries again."""
+    manager = ResourceManager()
+    def fail():
+      raise ValueError("unreachable")
+    assert_raises(ValueError, manager.acquire, resources.CLASS, "host", fail)
+    assert_equal("host", manager.acquire(resources.CLASS, "host",
+        lambda: "host"))
+
+  @test
+  def rejects_unknown_scopes(self):
+    """Only the four documented scopes are accepted."""
+    assert_raises(resources.UnknownScopeException, ResourceManager().acquire,
+        "module", "key", lambda: None)